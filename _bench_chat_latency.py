@@ -0,0 +1,194 @@
+"""End to end latency of the chat pipeline as a user sees it.
+
+Starts app.py under uvicorn with the local fake LLM backend, connects socket.io clients,
+sends prompts and times the sentences of the response to each prompt, matched by the
+response id in the server's response_sentences events (responses the meta agent starts
+on its own and re-rendered chat lines are not counted).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import socketio
+
+from delta_channel import apply_update
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return {"n": 0}
+    values = sorted(values)
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+    return {"n": len(values), "mean": statistics.fmean(values), "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": values[-1]}
+
+
+class BenchClient:
+    def __init__(self, url, settle_time, response_timeout):
+        self.url = url
+        self.settle_time = settle_time
+        self.response_timeout = response_timeout
+        self.sio = socketio.AsyncClient()
+        self.channels = {"chat": {"v": 0, "lines": []}, "debug": {"v": 0, "lines": []}}
+        self.emit_counts = {"chat": 0, "debug": 0}
+        self.last_chat_update = time.monotonic()
+        self.prompt = None
+        self.response_id = None
+        self.sentence_times = []
+        self.sio.on("update_chat", self._on_update_chat)
+        self.sio.on("update_debug", self._on_update_debug)
+        self.sio.on("response_sentences", self._on_response_sentences)
+
+    async def _apply(self, name, update):
+        channel = self.channels[name]
+        self.emit_counts[name] += 1
+        if not update["full"] and update["base"] != channel["v"]:
+            await self.sio.emit("request_resync", name)
+            return
+        channel["lines"] = apply_update(channel["lines"], update)
+        channel["v"] = update["v"]
+        await self.sio.emit("ack_update", {"channel": name, "v": update["v"]})
+
+    async def _on_update_chat(self, update):
+        await self._apply("chat", update)
+        self.last_chat_update = time.monotonic()
+
+    async def _on_response_sentences(self, data):
+        if data["prompt"] != self.prompt:
+            return
+        # the first response to our prompt is the one we time
+        if self.response_id is None:
+            self.response_id = data["response_id"]
+        if data["response_id"] != self.response_id:
+            return
+        arrived = time.monotonic()
+        self.sentence_times.extend([arrived] * data["count"])
+
+    async def _on_update_debug(self, update):
+        await self._apply("debug", update)
+
+    async def ask(self, prompt):
+        """Sends a prompt and returns the arrival times of its sentences relative to sending."""
+        self.prompt = prompt
+        self.response_id = None
+        self.sentence_times = []
+        start = time.monotonic()
+        await self.sio.emit("complete_sentence", prompt)
+        while time.monotonic() - start < self.response_timeout:
+            await asyncio.sleep(0.05)
+            if len(self.sentence_times) > 0 and time.monotonic() - self.last_chat_update > self.settle_time:
+                break
+        return [t - start for t in self.sentence_times]
+
+
+async def run_sessions(url, n_sessions, n_prompts, warmup, settle_time, response_timeout):
+    clients = [BenchClient(url, settle_time, response_timeout) for _ in range(n_sessions)]
+    await asyncio.gather(*[client.sio.connect(url, transports=["websocket"]) for client in clients])
+    # let the meta agent pick its first policy, it speaks once on its own
+    await asyncio.sleep(warmup)
+    start = time.monotonic()
+    emit_counts_before = [dict(client.emit_counts) for client in clients]
+
+    async def session(i, client):
+        results = []
+        for j in range(n_prompts):
+            results.append(await client.ask(f"session {i} prompt {j}: tell me about cabbages"))
+        return results
+
+    per_session = await asyncio.gather(*[session(i, client) for i, client in enumerate(clients)])
+    elapsed = time.monotonic() - start
+    emit_rates = []
+    for client, before in zip(clients, emit_counts_before):
+        emits = sum(client.emit_counts.values()) - sum(before.values())
+        emit_rates.append(emits / elapsed)
+    await asyncio.gather(*[client.sio.disconnect() for client in clients])
+    return per_session, emit_rates, elapsed
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"server did not start listening on {port}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--prompts", type=int, default=5, help="prompts per session")
+    parser.add_argument("--ttft", type=float, default=0.3, help="fake LLM time to first token, seconds")
+    parser.add_argument("--tps", type=float, default=50., help="fake LLM tokens per second")
+    parser.add_argument("--warmup", type=float, default=3.)
+    parser.add_argument("--settle", type=float, default=1., help="seconds without chat updates that end a response")
+    parser.add_argument("--timeout", type=float, default=30.)
+    parser.add_argument("--output", default=os.path.join("bench_results", f"chat_latency_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+    args = parser.parse_args()
+
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "AGENT_LAB_LLM_BACKEND": "fake",
+        "AGENT_LAB_FAKE_LLM_TTFT": str(args.ttft),
+        "AGENT_LAB_FAKE_LLM_TPS": str(args.tps),
+        "AGENT_LAB_MAX_SESSIONS": str(max(args.sessions, 1)),
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:sio_asgi_app", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        cpu_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        per_session, emit_rates, elapsed = asyncio.run(run_sessions(
+            f"http://127.0.0.1:{port}", args.sessions, args.prompts, args.warmup, args.settle, args.timeout))
+    finally:
+        server.terminate()
+        server.wait()
+    # children's usage only becomes visible once they are reaped, so this is the whole server run
+    cpu_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server_cpu = (cpu_after.ru_utime + cpu_after.ru_stime) - (cpu_before.ru_utime + cpu_before.ru_stime)
+
+    time_to_first_sentence = []
+    inter_sentence_gaps = []
+    unanswered = 0
+    for session in per_session:
+        for sentence_times in session:
+            if len(sentence_times) == 0:
+                unanswered += 1
+                continue
+            time_to_first_sentence.append(sentence_times[0])
+            inter_sentence_gaps.extend(b - a for a, b in zip(sentence_times, sentence_times[1:]))
+
+    results = {
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "unanswered_prompts": unanswered,
+        "time_to_first_sentence_s": percentiles(time_to_first_sentence),
+        "inter_sentence_gap_s": percentiles(inter_sentence_gaps),
+        "emits_per_second_per_session": percentiles(emit_rates),
+        "server_cpu_s": server_cpu,
+        "server_cpu_s_per_session": server_cpu / max(args.sessions, 1),
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as json_file:
+        json.dump(results, json_file, indent=4)
+    print(json.dumps(results, indent=4))
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
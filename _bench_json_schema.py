@@ -0,0 +1,98 @@
+import json
+import sys
+import timeit
+from copy import deepcopy
+
+from active_inference_service import select_policy_fn, track_policy_progress_fn, update_generative_model_fn
+from json_schema import dereference_refs
+
+# dereference_refs against the deepcopy-per-$ref version it replaced, on our tool schemas
+# and on synthetic schemas where many properties point at a deep tree of definitions
+
+
+def _legacy_retrieve_ref(path, schema):
+    out = schema
+    for component in path.split("/")[1:]:
+        out = out[component]
+    return deepcopy(out)
+
+
+def _legacy_dereference_refs_helper(obj, full_schema, skip_keys):
+    if isinstance(obj, dict):
+        obj_out = {}
+        for k, v in obj.items():
+            if k in skip_keys:
+                obj_out[k] = v
+            elif k == "$ref":
+                ref = _legacy_retrieve_ref(v, full_schema)
+                return _legacy_dereference_refs_helper(ref, full_schema, skip_keys)
+            elif isinstance(v, (list, dict)):
+                obj_out[k] = _legacy_dereference_refs_helper(v, full_schema, skip_keys)
+            else:
+                obj_out[k] = v
+        return obj_out
+    elif isinstance(obj, list):
+        return [_legacy_dereference_refs_helper(el, full_schema, skip_keys) for el in obj]
+    return obj
+
+
+def _legacy_infer_skip_keys(obj, full_schema):
+    keys = []
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == "$ref":
+                ref = _legacy_retrieve_ref(v, full_schema)
+                keys.append(v.split("/")[1])
+                keys += _legacy_infer_skip_keys(ref, full_schema)
+            elif isinstance(v, (list, dict)):
+                keys += _legacy_infer_skip_keys(v, full_schema)
+    elif isinstance(obj, list):
+        for el in obj:
+            keys += _legacy_infer_skip_keys(el, full_schema)
+    return keys
+
+
+def legacy_dereference_refs(schema_obj):
+    return _legacy_dereference_refs_helper(schema_obj, schema_obj, _legacy_infer_skip_keys(schema_obj, schema_obj))
+
+
+def synthetic_schema(depth, fan_out, n_properties):
+    """n_properties that all $ref the root of a tree of definitions depth levels deep."""
+    defs = {}
+    for level in range(depth):
+        properties = {f"field_{i}": {"type": "string", "description": f"level {level} field {i}"} for i in range(8)}
+        if level + 1 < depth:
+            for i in range(fan_out):
+                properties[f"child_{i}"] = {"$ref": f"#/$defs/Level{level + 1}"}
+        defs[f"Level{level}"] = {"type": "object", "properties": properties}
+    properties = {f"item_{i}": {"type": "array", "items": {"$ref": "#/$defs/Level0"}} for i in range(n_properties)}
+    return {"title": "synthetic", "type": "object", "properties": properties, "$defs": defs}
+
+
+def recursive_schema():
+    return {
+        "title": "tree",
+        "type": "object",
+        "properties": {"root": {"$ref": "#/$defs/Node"}},
+        "$defs": {"Node": {"type": "object", "properties": {"children": {"type": "array", "items": {"$ref": "#/$defs/Node"}}}}},
+    }
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    schemas = {
+        "select_policy_fn": select_policy_fn.model_json_schema(),
+        "track_policy_progress_fn": track_policy_progress_fn.model_json_schema(),
+        "update_generative_model_fn": update_generative_model_fn.model_json_schema(),
+        "synthetic depth=3 fan_out=3 x10": synthetic_schema(3, 3, 10),
+        "synthetic depth=4 fan_out=3 x10": synthetic_schema(4, 3, 10),
+    }
+    print(f"{'schema':<34} {'deepcopy us':>12} {'memoized us':>12} {'speedup':>9}")
+    for name, schema in schemas.items():
+        assert json.dumps(legacy_dereference_refs(schema), sort_keys=True) == json.dumps(dereference_refs(schema), sort_keys=True)
+        n = max(1, number // 50) if name.startswith("synthetic") else number
+        before = min(timeit.repeat(lambda: legacy_dereference_refs(schema), number=n, repeat=3)) / n * 1e6
+        after = min(timeit.repeat(lambda: dereference_refs(schema), number=n, repeat=3)) / n * 1e6
+        print(f"{name:<34} {before:>12.1f} {after:>12.1f} {before / after:>8.1f}x")
+    out = dereference_refs(recursive_schema())
+    print(f"recursive schema resolved, back reference kept as: {out['properties']['root']['properties']['children']['items']}")
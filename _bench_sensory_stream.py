@@ -0,0 +1,109 @@
+import datetime
+import sys
+import time
+import timeit
+import tracemalloc
+from dateutil import parser
+
+from sensory_stream import SensoryStream, iso_time_stamp
+
+# Render cost of SensoryStream with epoch float time stamps against the ISO string +
+# dateutil version it replaced, for streams of many events. The split is taken 99% of the
+# way through the stream, where a recent policy would put it.
+
+
+class LegacyStreamEvent:
+    def __init__(self, event, time_stamp):
+        self.event = event
+        self.time_stamp = time_stamp
+
+
+class LegacySensoryStream:
+    def __init__(self):
+        self.events = []
+
+    def _time_since(self, time_stamp):
+        return (datetime.datetime.utcnow() - parser.parse(time_stamp)).total_seconds()
+
+    def _pretty_print_time_since(self, time_stamp):
+        time_since = self._time_since(time_stamp)
+        if time_since < 1:
+            return "just now"
+        if time_since < 60:
+            return f"{int(time_since)} seconds ago"
+        elif time_since < 3600:
+            return f"{int(time_since / 60)} minutes ago"
+        elif time_since < 86400:
+            return f"{int(time_since / 3600)} hours ago"
+        else:
+            return f"{int(time_since / 86400)} days ago"
+
+    def pritty_print(self):
+        return "\n".join(f"{event.event} - {self._pretty_print_time_since(event.time_stamp)}" for event in self.events)
+
+    def pritty_print_split(self, time_stamp_to_split):
+        before_lines = []
+        after_lines = []
+        for event in self.events:
+            line = f"{event.event} - {self._pretty_print_time_since(event.time_stamp)}"
+            if event.time_stamp < time_stamp_to_split:
+                before_lines.append(line)
+            else:
+                after_lines.append(line)
+        return "\n".join(before_lines), "\n".join(after_lines)
+
+
+def build_streams(n_events, span_seconds=3 * 3600):
+    legacy = LegacySensoryStream()
+    stream = SensoryStream(capacity=n_events)
+    start = time.time() - span_seconds
+    for i in range(n_events):
+        time_stamp = start + span_seconds * i / n_events
+        event = f"User: message number {i}" if i % 2 else f"Assistant: reply number {i}"
+        legacy.events.append(LegacyStreamEvent(event, iso_time_stamp(time_stamp)))
+        stream.append_event(event, time_stamp)
+    # policies are recent, most of the stream is before them
+    return legacy, stream, start + span_seconds * 0.99
+
+
+def same_render(legacy_text, text):
+    legacy_lines = legacy_text.split("\n")
+    lines = text.split("\n")
+    if [line.rsplit(" - ", 1)[0] for line in legacy_lines] != [line.rsplit(" - ", 1)[0] for line in lines]:
+        return False
+    return sum(1 for a, b in zip(legacy_lines, lines) if a != b) <= len(lines) // 100
+
+
+def allocated_bytes(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, kept
+
+
+if __name__ == "__main__":
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    legacy, stream, split_at = build_streams(n_events)
+    # the legacy render reads the clock per event, so an age can tick over a unit mid render
+    assert same_render(legacy.pritty_print(), stream.pritty_print())
+    for legacy_half, half in zip(legacy.pritty_print_split(iso_time_stamp(split_at)), stream.pritty_print_split(split_at)):
+        assert same_render(legacy_half, "\n".join(half))
+
+    print(f"{n_events} events")
+    print(f"{'render':<22} {'iso+dateutil ms':>16} {'epoch floats ms':>16} {'speedup':>9}")
+    cases = {
+        "pritty_print": (lambda: legacy.pritty_print(), lambda: stream.pritty_print()),
+        "pritty_print_split": (lambda: legacy.pritty_print_split(iso_time_stamp(split_at)), lambda: ["\n".join(half) for half in stream.pritty_print_split(split_at)]),
+        # what track_policy_progress and update_generative_model use
+        "split, after policy": (lambda: legacy.pritty_print_split(iso_time_stamp(split_at))[1].split("\n"), lambda: list(stream.pritty_print_split(split_at)[1])),
+    }
+    for name, (legacy_fn, fn) in cases.items():
+        before = min(timeit.repeat(legacy_fn, number=1, repeat=3)) * 1000
+        after = min(timeit.repeat(fn, number=3, repeat=3)) / 3 * 1000
+        print(f"{name:<22} {before:>16.1f} {after:>16.1f} {before / after:>8.1f}x")
+
+    legacy_bytes, _ = allocated_bytes(lambda: build_streams(n_events)[0])
+    stream_bytes, _ = allocated_bytes(lambda: build_streams(n_events)[1])
+    print(f"memory per event: iso+dateutil {legacy_bytes / n_events:.0f} bytes, epoch floats {stream_bytes / n_events:.0f} bytes")
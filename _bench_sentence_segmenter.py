@@ -0,0 +1,130 @@
+import random
+import sys
+import time
+
+from local_llm_backend import sample_sentences
+from sentence_segmenter import SentenceSegmenter
+
+# SentenceSegmenter against the rescan-everything-per-chunk check it replaced
+# (ChatService._should_we_send_to_voice). Checks the corpus below first, then measures
+# characters per second on streams chunked like LLM tokens.
+
+# (chunks as streamed, expected sentences, expected remainder at the end of the stream)
+corpus = [
+    (["Hi. How are", " you? I am", " fine."], ["Hi.", " How are you?"], " I am fine."),
+    (["The heaviest cabbage was 62.71 kilograms. Wow"], ["The heaviest cabbage was 62.71 kilograms."], " Wow"),
+    (["Wait", "...", " what", "?!", " Ok", ".", " "], ["Wait...", " what?!", " Ok."], " "),
+    (['He said "Hello. How are you?"', " and left. Bye"], ['He said "Hello. How are you?"', " and left."], " Bye"),
+    (["Then (see p. 5) we go. Next"], ["Then (see p. 5) we go."], " Next"),
+    (["Then (see p. 5.) we go."], ["Then (see p. 5.)"], " we go."),
+    (["A list [one. two] done. ", "B"], ["A list [one. two] done."], " B"),
+    (["A list [one. two.] done. ", "B"], ["A list [one. two.]", " done."], " B"),
+    (['Unclosed "quote. Still going\n', "New line. ok"], ['Unclosed "quote. Still going\nNew line.'], " ok"),
+    (["(Ooh, cabbages.) Horses."], ["(Ooh, cabbages.)"], " Horses."),
+    (["e.g. this", " and i.e. that."], ["e.g.", " this and i.e."], " that."),
+    (["no terminator at all, just words"], [], "no terminator at all, just words"),
+    (["one.two.three. four"], ["one.two.three."], " four"),
+    (["", "Empty chunks. ", "", "Fine."], ["Empty chunks."], " Fine."),
+    (["Oh no :( that is sad. Still", " here? Yes"], ["Oh no :( that is sad.", " Still here?"], " Yes"),
+    (["Nice :", ") Thanks. Bye"], ["Nice :) Thanks."], " Bye"),
+    (["An aside (never closed" + " word" * 50 + ". Next. After"], ["An aside (never closed" + " word" * 50 + ".", " Next."], " After"),
+]
+
+
+def _legacy_should_we_send_to_voice(sentence):
+    sentence_termination_characters = [".", "?", "!"]
+    close_brackets = ['"', ')', ']']
+    if sentence is None or sentence.isspace():
+        return None
+    if not any(c in sentence for c in sentence_termination_characters):
+        return None
+    if sentence[-1] in sentence_termination_characters:
+        return None
+    if sentence[-1] in close_brackets:
+        return None
+    termination_indices = [sentence.rfind(char) for char in sentence_termination_characters]
+    termination_indices = [i for i in termination_indices if sentence[i+1].isspace()]
+    if len(termination_indices) == 0:
+        return None
+    last_termination_index = max(termination_indices)
+    while last_termination_index+1 < len(sentence) and sentence[last_termination_index+1] in close_brackets:
+        last_termination_index += 1
+    return sentence[:last_termination_index+1]
+
+
+def legacy_segment(chunks):
+    sentences = []
+    current_sentence = ""
+    for chunk in chunks:
+        current_sentence += chunk
+        text_to_speak = _legacy_should_we_send_to_voice(current_sentence)
+        if text_to_speak:
+            current_sentence = current_sentence[len(text_to_speak):]
+            sentences.append(text_to_speak)
+    return sentences, current_sentence
+
+
+def segment(chunks):
+    segmenter = SentenceSegmenter()
+    sentences = []
+    for chunk in chunks:
+        sentences.extend(segmenter.feed(chunk))
+    return sentences, segmenter.flush()
+
+
+def segment_with_previews(chunks):
+    # as ChatService uses it, the preview is read after every chunk that ends no sentence
+    segmenter = SentenceSegmenter()
+    sentences = []
+    for chunk in chunks:
+        new_sentences = segmenter.feed(chunk)
+        sentences.extend(new_sentences)
+        if len(new_sentences) == 0:
+            segmenter.pending
+    return sentences, segmenter.flush()
+
+
+def token_chunks(text, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 6)
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+
+def chars_per_second(fn, chunks, min_time=0.5):
+    n_chars = sum(len(chunk) for chunk in chunks)
+    runs = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        fn(chunks)
+        runs += 1
+    return n_chars * runs / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    for chunks, expected_sentences, expected_remainder in corpus:
+        sentences, remainder = segment(chunks)
+        assert (sentences, remainder) == (expected_sentences, expected_remainder), f"{chunks}: got {(sentences, remainder)}"
+        # however a stream is chunked the sentences come out the same
+        assert segment(list("".join(chunks))) == (sentences, remainder)
+        assert segment_with_previews(chunks) == (sentences, remainder)
+    print(f"corpus: {len(corpus)} cases ok")
+
+    rng = random.Random(0)
+    n_chars = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    prose = " ".join(rng.choice(sample_sentences) for _ in range(n_chars // 30))[:n_chars]
+    run_on = ("and then the horses, " * (n_chars // 21 + 1))[:n_chars]
+    streams = {
+        f"prose {len(prose)} chars": token_chunks(prose),
+        f"no terminator {len(run_on)} chars": token_chunks(run_on),
+    }
+    print(f"{'stream':<28} {'legacy chars/s':>15} {'segmenter chars/s':>18} {'+ previews chars/s':>19}")
+    for name, chunks in streams.items():
+        legacy = chars_per_second(legacy_segment, chunks)
+        segmenter = chars_per_second(segment, chunks)
+        with_previews = chars_per_second(segment_with_previews, chunks)
+        print(f"{name:<28} {legacy:>15,.0f} {segmenter:>18,.0f} {with_previews:>19,.0f}")
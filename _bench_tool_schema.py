@@ -0,0 +1,34 @@
+import sys
+import timeit
+
+from active_inference_service import select_policy_fn, track_policy_progress_fn, update_generative_model_fn
+from langchain_helper import compile_tools, convert_pydantic_to_openai_function
+
+# per-call cost of building the tools argument for invoke_llm_async, uncached vs memoized
+
+tool_sets = {
+    "select_policy_fn": [select_policy_fn],
+    "track_policy_progress_fn": [track_policy_progress_fn],
+    "update_generative_model_fn": [update_generative_model_fn],
+}
+
+
+def uncached(functions):
+    openai_functions = [convert_pydantic_to_openai_function(f) for f in functions]
+    fn_names = [oai_fn["function"]["name"] for oai_fn in openai_functions]
+    return openai_functions, fn_names
+
+
+def cached(functions):
+    compiled_tools = compile_tools(functions)
+    return compiled_tools["openai_functions"], compiled_tools["fn_names"]
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print(f"{'tool':<28} {'uncached us':>12} {'memoized us':>12} {'speedup':>9}")
+    for name, functions in tool_sets.items():
+        assert uncached(functions) == cached(functions)
+        before = min(timeit.repeat(lambda: uncached(functions), number=number, repeat=3)) / number * 1e6
+        after = min(timeit.repeat(lambda: cached(functions), number=number, repeat=3)) / number * 1e6
+        print(f"{name:<28} {before:>12.2f} {after:>12.2f} {before / after:>8.0f}x")
@@ -0,0 +1,73 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+import numpy as np
+
+from vector_index import ChromaIndex, NumpyIndex
+
+# compares the VectorDB backends on random embeddings the size of all-MiniLM-L6-v2's
+embedding_size = 384
+n_queries = 200
+n_results = 5
+
+
+def make_backend(name, path):
+    if name == "chroma":
+        return ChromaIndex(path, name="bench", space="l2")
+    return NumpyIndex(path, space="l2")
+
+
+def bench_backend(name, n_documents, rng):
+    path = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    try:
+        embeddings = rng.standard_normal((n_documents, embedding_size)).astype(np.float32)
+        ids = [str(uuid.uuid4()) for _ in range(n_documents)]
+        documents = [f"document {i}" for i in range(n_documents)]
+        metadatas = [{"prior_category": f"category {i % 12}", "prior_type": "belief" if i % 2 else "desire"} for i in range(n_documents)]
+
+        start = time.perf_counter()
+        index = make_backend(name, path)
+        batch_size = min(index.max_batch_size, 4096)
+        for i in range(0, n_documents, batch_size):
+            index.add(ids[i:i + batch_size], documents[i:i + batch_size], metadatas[i:i + batch_size], embeddings[i:i + batch_size])
+        index.persist()
+        build_time = time.perf_counter() - start
+        del index
+
+        start = time.perf_counter()
+        index = make_backend(name, path)
+        assert index.count() == n_documents
+        startup_time = time.perf_counter() - start
+
+        queries = rng.standard_normal((n_queries, embedding_size)).astype(np.float32)
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            index.query([query], n_results=n_results)
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        return {
+            "build_s": build_time,
+            "startup_ms": startup_time * 1000,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000, 50000]
+    rng = np.random.default_rng(0)
+    print(f"{'backend':<8} {'docs':>7} {'build s':>9} {'startup ms':>11} {'query p50 ms':>13} {'query p95 ms':>13}")
+    for n_documents in sizes:
+        for name in ["numpy", "chroma"]:
+            try:
+                result = bench_backend(name, n_documents, rng)
+            except ImportError as e:
+                print(f"{name:<8} {n_documents:>7} skipped: {e}")
+                continue
+            print(f"{name:<8} {n_documents:>7} {result['build_s']:>9.2f} {result['startup_ms']:>11.2f} {result['p50_ms']:>13.3f} {result['p95_ms']:>13.3f}")
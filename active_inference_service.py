@@ -1,10 +1,9 @@
 import asyncio
-import datetime
-from dateutil import parser
 from enum import Enum
 import itertools
 import json
 import os
+import time
 import traceback
 import openai
 from openai import AsyncOpenAI
@@ -13,28 +12,70 @@ from pydantic import BaseModel, Field, PrivateAttr
 from typing import Any, Callable, ForwardRef, List, Optional, Sequence
 from generative_model import GenerativeModel
 
-from langchain_helper import convert_pydantic_to_openai_function, create_instance_from_response
-from sensory_stream import SensoryStream
+from langchain_helper import compile_tools, create_instance_from_response
+from llm_client import get_shared_async_openai_client
+from llm_response_cache import LLMResponseCache, default_response_cache
+from retry_policy import InvalidResponseError, RetryPolicy, default_retry_policy
+from sensory_stream import SensoryStream, iso_time_stamp, pretty_print_time_since
 
 Policy = ForwardRef('Policy')
 update_generative_model_fn = ForwardRef('update_generative_model_fn')
 track_policy_progress_fn = ForwardRef('track_policy_progress_fn')
 select_policy_fn = ForwardRef('select_policy_fn')
 
+def _common_prefix_length(a:str, b:str) -> int:
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class PromptPrefixStats:
+    """How much of each prompt repeats the start of the previous prompt of the same kind,
+    i.e. what a provider side prefix cache could reuse, in characters of serialized messages."""
+    def __init__(self):
+        self._last_prompts = {}
+        self.prefix_chars = 0
+        self.total_chars = 0
+
+    def record(self, kind:str, messages):
+        prompt = json.dumps(messages, ensure_ascii=False)
+        last_prompt = self._last_prompts.get(kind)
+        if last_prompt is not None:
+            self.prefix_chars += _common_prefix_length(last_prompt, prompt)
+            self.total_chars += len(prompt)
+        self._last_prompts[kind] = prompt
+
+    @property
+    def hit_ratio(self):
+        return self.prefix_chars / self.total_chars if self.total_chars else 0.
+
+
 class ActiveInferenceService:
-    def __init__(self, api="openai", fast_model_id = "gpt-3.5-turbo", best_model_id="gpt-4"):
+    def __init__(self, api="openai", fast_model_id = "gpt-3.5-turbo", best_model_id="gpt-4", response_cache:LLMResponseCache = None, aclient:AsyncOpenAI = None, retry_policy:RetryPolicy = None, stable_prompts=None, prefix_stats:"PromptPrefixStats" = None):
         self._api = api
-        self._aclient = AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+        self._aclient = aclient if aclient is not None else get_shared_async_openai_client()
+        self._retry_policy = retry_policy if retry_policy is not None else default_retry_policy()
         self._fast_model_id = fast_model_id
         self._best_model_id = best_model_id
+        self._response_cache = response_cache if response_cache is not None else default_response_cache()
+        # AGENT_LAB_STABLE_PROMPTS=1 renders prompts for prefix caching, see _stable_messages
+        self.stable_prompts = stable_prompts if stable_prompts is not None else os.getenv("AGENT_LAB_STABLE_PROMPTS", "0") == "1"
+        self.prefix_stats = prefix_stats if prefix_stats is not None else PromptPrefixStats()
+
+    async def _create_message(self, request):
+        response = await self._aclient.chat.completions.create(**request)
+        return response.choices[0].message
 
 
     async def invoke_llm_async(self, messages, functions, use_best=False, cancel_event=None):
-        delay = 0.1
-        openai_functions = [convert_pydantic_to_openai_function(f) for f in functions]
-        fn_names = [oai_fn["function"]["name"] for oai_fn in openai_functions]
+        compiled_tools = compile_tools(functions)
+        openai_functions = compiled_tools["openai_functions"]
+        fn_names = compiled_tools["fn_names"]
         # function_call="auto" if len(functions) > 1 else f"{{'name': '{fn_names[0]}'}}"
         function_call="auto" if len(functions) > 1 else {
             "type": "function", 
@@ -42,53 +83,82 @@ class ActiveInferenceService:
         }
         # function_call="auto"
         model_id = self._best_model_id if use_best else self._fast_model_id
+        self.prefix_stats.record(fn_names[0], messages)
+
+        request = dict(
+            model=model_id,
+            messages=messages,
+            temperature=1.0,
+            tools=openai_functions,
+            tool_choice=function_call,
+            stream=False
+        )
 
-        while True:
+        async def attempt():
+            output = await self._response_cache.get_message(request, lambda: self._create_message(request))
             try:
-                response = await self._aclient.chat.completions.create(
-                    model=model_id,
-                    messages=messages,
-                    temperature=1.0,
-                    tools=openai_functions,
-                    tool_choice=function_call,
-                    stream=False
-                )
-                output = response.choices[0].message
                 function_instances = create_instance_from_response(output, functions)
-                if len(function_instances) == 0:
-                    raise Exception("No function call in the response.")
+                if function_instances is None or len(function_instances) == 0:
+                    raise InvalidResponseError("No function call in the response.")
                 if len(function_instances) > 1:
-                    raise Exception("only 1 function call currently supported.")
-                return function_instances[0]
-
-            except openai.APIError as e:
-                print(f"OpenAI API returned an API Error: {e}")
-                print(f"Retrying in {delay} seconds...")
-
-            # except openai.error.APIConnectionError as e:
-            #     print(f"Failed to connect to OpenAI API: {e}")
-            #     print(f"Retrying in {delay} seconds...")
-
-            # except openai.error.RateLimitError as e:
-            #     print(f"OpenAI API request exceeded rate limit: {e}")
-            #     print(f"Retrying in {delay} seconds...")
-
-            except Exception as e:
-                print(f"OpenAI API unknown error: {e}")
-                trace = traceback.format_exc()
-                print(f"trace: {trace}")
-                print(f"Retrying in {delay} seconds...")
+                    raise InvalidResponseError("only 1 function call currently supported.")
+            except Exception:
+                # don't replay a response we can't use
+                self._response_cache.discard(request)
+                raise
+            return function_instances[0]
+
+        return await self._retry_policy.call(attempt)
+
+    def _stable_generative_model_json(self, generative_model: GenerativeModel):
+        # model_dump_json keeps set iteration order, which changes between runs, sort so the same model is always the same text
+        return json.dumps({key: sorted(value) for key, value in generative_model.model_dump().items()}, sort_keys=True)
+
+    def _stable_messages(self, instructions:str, sections:[(str, str)], stream:([str], [str]), volatile_lines:[str]):
+        """Messages laid out so consecutive prompts share as long a prefix as possible: the
+        fixed instructions, then the slower changing sections (policy, generative model), then
+        the stream's summary in a message of its own (it changes when the stream is compacted),
+        then one message per stream event with absolute times (append only, see
+        SensoryStream.pritty_print_stable), then what changes on every call."""
+        system_prompt = f"""
+You are an Artificial Intelligence expert specializing in Active Inference, the Free Energy Principle, and the Markov Blanket. Your landmark research showed that Large Language Models (LLMs) like GPT-4 can perform Active Inference.
 
-            await asyncio.sleep(delay)
-            delay *= 2
+{instructions}
+"""
+        for title, content in sections:
+            system_prompt += f"""
+*** {title} ***
+```json
+{content}
+```
+"""
+        messages = [{"role": "system", "content": system_prompt}]
+        summary_lines, stream_lines = stream
+        if len(summary_lines):
+            messages.append({"role": "user", "content": "\n".join(summary_lines)})
+        for line in stream_lines:
+            messages.append({"role": "user", "content": line})
+        messages.append({"role": "user", "content": "\n".join(volatile_lines)})
+        return messages
+
+    def _current_time_bucket(self):
+        now = time.time()
+        return iso_time_stamp(now - now % 60)[:16]
 
     async def select_policy(self, sensory_stream: SensoryStream, generative_model: GenerativeModel)->select_policy_fn:
-        messages = []
-        # before_policy_stream, after_policy_stream = sensory_stream.pritty_print_split(cur_policy._time_stamp)
-        # before_policy_stream = before_policy_stream.split("\n")
-        # after_policy_stream = after_policy_stream.split("\n")
-        stream = sensory_stream.pritty_print().split("\n")
-        system_prompt = f"""
+        if self.stable_prompts:
+            messages = self._stable_messages(
+                "Analyze the input stream and make any modifications to the generative model (the hidden states, beliefs, desires) from the perspective of the assistant.",
+                [("Current/Previous Generative Model", self._stable_generative_model_json(generative_model))],
+                sensory_stream.pritty_print_stable(),
+                [f"current_time: {self._current_time_bucket()}"])
+        else:
+            messages = []
+            # before_policy_stream, after_policy_stream = sensory_stream.pritty_print_split(cur_policy._time_stamp)
+            # before_policy_stream = before_policy_stream.split("\n")
+            # after_policy_stream = after_policy_stream.split("\n")
+            stream = sensory_stream.pritty_print().split("\n")
+            system_prompt = f"""
 You are an Artificial Intelligence expert specializing in Active Inference, the Free Energy Principle, and the Markov Blanket. Your landmark research showed that Large Language Models (LLMs) like GPT-4 can perform Active Inference.
 
 Analyze the following input stream and make any modifications to the generative model (the hidden states, beliefs, desires) from the perspective of the assistant.
@@ -103,7 +173,7 @@ Analyze the following input stream and make any modifications to the generative
 ```
 
 """
-        messages.append({"role": "system", "content": system_prompt})
+            messages.append({"role": "system", "content": system_prompt})
         functions = [
             select_policy_fn
         ]
@@ -114,31 +184,56 @@ Analyze the following input stream and make any modifications to the generative
             select_policies_result.selected_policy_idx = max_index
         return select_policies_result
 
-    def _pretty_print_time_since(self, time_stamp):
-        current_utc_time = datetime.datetime.utcnow()
-        past_time = parser.parse(time_stamp)
-        time_since = (current_utc_time - past_time).total_seconds()
-        if time_since < 1:
-            return "just now"
-        if time_since < 60:
-            return f"{int(time_since)} seconds ago"
-        elif time_since < 3600:
-            return f"{int(time_since / 60)} minutes ago"
-        elif time_since < 86400:
-            return f"{int(time_since / 3600)} hours ago"
-        else:
-            return f"{int(time_since / 86400)} days ago"
+    async def summarize_stream(self, summary: str, evicted_lines: [str])->str:
+        """For SensoryStream.compact_async, folds events that dropped out of the stream into its summary."""
+        system_prompt = f"""
+You maintain a running summary of an assistant's input stream. Events that are too old to be shown in full are folded into the summary, which replaces them in every future prompt.
+
+*** Current Summary ***
+{summary if len(summary) else "(empty)"}
+"""
+        return await self._summarize(system_prompt, evicted_lines, summarize_stream_fn)
+
+    async def summarize_conversation(self, summary: str, trimmed_lines: [str])->str:
+        """For PromptManager.compact_async, folds chat turns that no longer fit the prompt into the conversation summary."""
+        system_prompt = f"""
+You maintain a running summary of a conversation between a user and an assistant. The oldest turns no longer fit in the assistant's prompt, they are folded into the summary, which stands in for them from now on.
+
+*** Current Summary ***
+{summary if len(summary) else "(empty)"}
+"""
+        return await self._summarize(system_prompt, trimmed_lines, summarize_conversation_fn)
+
+    async def _summarize(self, system_prompt: str, lines: [str], summary_fn)->str:
+        messages = []
+        messages.append({"role": "system", "content": system_prompt})
+        for line in lines:
+            messages.append({"role": "user", "content": line})
+        functions = [
+            summary_fn
+        ]
+        result = await self.invoke_llm_async(messages, functions, use_best=False)
+        return result.summary
+
+    def _pretty_print_time_since(self, time_stamp:float):
+        return pretty_print_time_since(time_stamp)
         
     async def track_policy_progress(self, sensory_stream: SensoryStream, generative_model: GenerativeModel, cur_policy: Policy)->track_policy_progress_fn:
-        messages = []
-        # stream = sensory_stream.pritty_print().split("\n")
-        before_policy_stream, after_policy_stream = sensory_stream.pritty_print_split(cur_policy._time_stamp)
-        before_policy_stream = before_policy_stream.split("\n")
-        after_policy_stream = after_policy_stream.split("\n")
         policy_age = self._pretty_print_time_since(cur_policy._time_stamp)
-        after_policy_stream.append(f"time_since_policy: {policy_age}")
+        if self.stable_prompts:
+            messages = self._stable_messages(
+                "Analyze the input stream:",
+                [("Assistant's Current Policy", cur_policy.model_dump_json())],
+                sensory_stream.pritty_print_stable(since=cur_policy._time_stamp),
+                [f"current_time: {self._current_time_bucket()}", f"time_since_policy: {policy_age}"])
+        else:
+            messages = []
+            # stream = sensory_stream.pritty_print().split("\n")
+            before_policy_stream, after_policy_stream = sensory_stream.pritty_print_split(cur_policy._time_stamp)
+            after_policy_stream = list(after_policy_stream)
+            after_policy_stream.append(f"time_since_policy: {policy_age}")
 
-        system_prompt = f"""
+            system_prompt = f"""
 You are an Artificial Intelligence expert specializing in Active Inference, the Free Energy Principle, and the Markov Blanket. Your landmark research showed that Large Language Models (LLMs) like GPT-4 can perform Active Inference.
 
 Analyze the input stream:
@@ -148,9 +243,9 @@ Analyze the input stream:
 {cur_policy.model_dump_json()}
 ```
 """
-        messages.append({"role": "system", "content": system_prompt})
-        for message in after_policy_stream:
-            messages.append({"role": "user", "content": message})
+            messages.append({"role": "system", "content": system_prompt})
+            for message in after_policy_stream:
+                messages.append({"role": "user", "content": message})
         functions = [
             track_policy_progress_fn
         ]
@@ -158,15 +253,23 @@ Analyze the input stream:
         return updates
     
     async def update_generative_model(self, sensory_stream: SensoryStream, generative_model: GenerativeModel, cur_policy: Policy)->update_generative_model_fn:
-        messages = []
-        # stream = sensory_stream.pritty_print().split("\n")
-        before_policy_stream, after_policy_stream = sensory_stream.pritty_print_split(cur_policy._time_stamp)
-        before_policy_stream = before_policy_stream.split("\n")
-        after_policy_stream = after_policy_stream.split("\n")
         policy_age = self._pretty_print_time_since(cur_policy._time_stamp)
-        after_policy_stream.append(f"time_since_policy: {policy_age}")
+        if self.stable_prompts:
+            # the policy lasts several steps, the model changes every step, so the policy goes first
+            messages = self._stable_messages(
+                "Analyze the following input stream and make any modifications to the generative model (the hidden states, beliefs, desires) from the perspective of the assistant.",
+                [("Assistant's Current Policy", cur_policy.model_dump_json()),
+                 ("Current/Previous Generative Model", self._stable_generative_model_json(generative_model))],
+                sensory_stream.pritty_print_stable(since=cur_policy._time_stamp),
+                [f"current_time: {self._current_time_bucket()}", f"time_since_policy: {policy_age}"])
+        else:
+            messages = []
+            # stream = sensory_stream.pritty_print().split("\n")
+            before_policy_stream, after_policy_stream = sensory_stream.pritty_print_split(cur_policy._time_stamp)
+            after_policy_stream = list(after_policy_stream)
+            after_policy_stream.append(f"time_since_policy: {policy_age}")
 
-        system_prompt = f"""
+            system_prompt = f"""
 You are an Artificial Intelligence expert specializing in Active Inference, the Free Energy Principle, and the Markov Blanket. Your landmark research showed that Large Language Models (LLMs) like GPT-4 can perform Active Inference.
 
 Analyze the following input stream and make any modifications to the generative model (the hidden states, beliefs, desires) from the perspective of the assistant.
@@ -181,18 +284,22 @@ Analyze the following input stream and make any modifications to the generative
 {cur_policy.model_dump_json()}
 ```
 """
-        messages.append({"role": "system", "content": system_prompt})
-        for message in after_policy_stream:
-            messages.append({"role": "user", "content": message})
+            messages.append({"role": "system", "content": system_prompt})
+            for message in after_policy_stream:
+                messages.append({"role": "user", "content": message})
         functions = [
             update_generative_model_fn
         ]
         updates: update_generative_model_fn = await self.invoke_llm_async(messages, functions, use_best=False)
         return updates
 
-def _time_stamp():
-    utc_time = datetime.datetime.utcnow()
-    return utc_time.isoformat()
+class summarize_stream_fn(BaseModel):
+    """Merge the earlier events into the existing summary of the input stream."""
+    summary: str = Field(..., description="the updated summary, a short paragraph from the assistant's point of view. Keep who said what, facts learned about the user, and open questions. Drop small talk.")
+
+class summarize_conversation_fn(BaseModel):
+    """Merge the earlier turns into the existing summary of the conversation."""
+    summary: str = Field(..., description="the updated summary, a short paragraph from the assistant's point of view. Keep what the user asked and told you, what you answered or promised, and open questions. Drop small talk.")
 
 class Policy(BaseModel):
     """A set of actions the assistant takes to reduce free energy"""
@@ -200,7 +307,8 @@ class Policy(BaseModel):
     expected_outcome:str = Field(..., description="expected changes that the policy will produce in perception, hidden_states, and/or beliefs")
     estimated_free_energy_reduction: float = Field(...,  description= "how much free energy the policy will remove from the system. int between 1 and 10")
     probability_of_success: float = Field(...,  description= "how likley the assistant is to succeed with this policy, between 0 and 1")
-    _time_stamp: str = PrivateAttr(default_factory=_time_stamp)
+    # epoch seconds, comparable with SensoryStream time stamps
+    _time_stamp: float = PrivateAttr(default_factory=time.time)
 
 # class EditBelifActionEnum(str, Enum):
 #     create = "create"
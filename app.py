@@ -1,16 +1,23 @@
 import asyncio
+import time
 import traceback
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import socketio
 import uvicorn
+from delta_channel import DeltaChannel
+from event_log import close_user_stream, issue_user_token, open_user_stream, user_id_from_token
+from llm_client import shared_pool_metrics
+from retry_policy import default_retry_policy
+from active_inference_service import ActiveInferenceService
 from meta_agent import MetaAgent
 
 from prompt_manager import PromptManager
 from respond_to_prompt import RespondToPromptAsync
 from response_state_manager import ResponseStateManager
 from sensory_stream import SensoryStream
+from session_registry import SessionRegistry
 
 
 app = FastAPI()
@@ -26,9 +33,17 @@ app.add_middleware(
         )
 
 class Main:
-    def __init__(self):
+    def __init__(self, sid, user_id=None):
+        self.sid = sid
+        # sids change on every reconnect, the user id (issued by us, see connect) does not.
+        # None for sessions that are not a known user, those are not logged
+        self.user_id = user_id
         self.chat_history = ["lazy init"]
         self.debug_info = []
+        self.delta_channels = {
+            "chat": DeltaChannel("chat"),
+            "debug": DeltaChannel("debug"),
+        }
         self.user_typing_feed = ""
         self.response_state_manager = ResponseStateManager()
         self.prompt_manager = PromptManager()
@@ -36,29 +51,148 @@ class Main:
         self.respond_to_prompt = None
         self.respond_to_prompt_task = None
         self.meta_agent = MetaAgent()
+        # replaced by the user's restored stream in start()
         self.sensory_stream = SensoryStream()
-        self.sensory_stream.append_event("An unknown user entered...")
-
-        @sio.event
-        async def connect(sid, environ):
-            print(f"User connected: {sid}")
-
-        @sio.event
-        async def typing_in_progress(sid, data):
-            self.user_typing_feed = data
-
-        @sio.event
-        async def complete_sentence(sid, prompt):
-            self.user_typing_feed = ""
-            response_preview_text = self.response_state_manager.pretty_print_current_responses()
-            if len(response_preview_text) > 0:
-                self.add_output_to_history(response_preview_text)
-            self.add_output_to_history(f"👨 {prompt}\n")
-            self.prompt_manager.replace_or_append_user_message(prompt)
-            self.sensory_stream.append_user_message(prompt)
-            self.respond_to_prompt = RespondToPromptAsync(self.response_state_manager)
-            self.respond_to_prompt_task = asyncio.create_task(self.respond_to_prompt.run(prompt, self.prompt_manager.messages))
-            response_step_obs, response_state = self.response_state_manager.reset_episode()
+        self._user_stream_open = False
+        self._tasks = []
+        self._compact_prompt_task = None
+        # which response the published sentences belong to, see main_loop's "response_sentences"
+        self.response_id = 0
+        self.response_prompt = None
+        self._terminating_responses = set()
+        self.superseded_responses = 0
+        # seconds from superseding a response until its task (and LLM stream) is gone
+        self.cancellation_latencies = []
+        # changes arriving within this window are batched into a single UI update
+        self.update_coalesce_window = 1 / 30
+
+    async def start(self):
+        # the user's perception history survives restarts when AGENT_LAB_EVENT_LOG_DIR is set
+        self.sensory_stream = await open_user_stream(self.user_id)
+        self._user_stream_open = True
+        if len(self.sensory_stream):
+            self.sensory_stream.append_event("The user came back...")
+        else:
+            self.sensory_stream.append_event("An unknown user entered...")
+        self._tasks = [
+            asyncio.create_task(self.main_loop()),
+            asyncio.create_task(self.eval_loop()),
+        ]
+
+    async def stop(self):
+        tasks = list(self._tasks) + list(self._terminating_responses)
+        if self.respond_to_prompt_task is not None:
+            tasks.append(self.respond_to_prompt_task)
+        if self._compact_prompt_task is not None:
+            tasks.append(self._compact_prompt_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self._user_stream_open:
+            self._user_stream_open = False
+            try:
+                await close_user_stream(self.user_id)
+            except Exception as e:
+                print(f"Exception closing event log: {e}")
+
+    async def emit(self, event, data):
+        await sio.emit(event, data, to=self.sid)
+
+    async def emit_delta(self, event, channel_name, lines):
+        update = self.delta_channels[channel_name].make_update(lines)
+        if update is not None:
+            await self.emit(event, update)
+
+    def ack_update(self, channel_name, version):
+        channel = self.delta_channels.get(channel_name)
+        if channel is not None:
+            channel.ack(version)
+
+    def request_resync(self, channel_name=None):
+        for name, channel in self.delta_channels.items():
+            if channel_name is None or name == channel_name:
+                channel.resync()
+        self.response_state_manager.notify_changed()
+
+    def supersede_response(self):
+        """Stops the response in flight, if any, before a new one starts.
+
+        Publishing stops right away so nothing stale reaches the UI; the task and its LLM
+        stream are torn down in the background, timed into cancellation_latencies."""
+        if self.respond_to_prompt_task is None or self.respond_to_prompt_task.done():
+            return
+        respond_to_prompt = self.respond_to_prompt
+        respond_to_prompt_task = self.respond_to_prompt_task
+        respond_to_prompt.cancel()
+        respond_to_prompt_task.cancel()
+        self.superseded_responses += 1
+        start_time = time.monotonic()
+
+        async def wait_for_termination():
+            await respond_to_prompt.terminate()
+            await asyncio.gather(respond_to_prompt_task, return_exceptions=True)
+            self.cancellation_latencies.append(time.monotonic() - start_time)
+            if len(self.cancellation_latencies) > 100:
+                self.cancellation_latencies.pop(0)
+            self.response_state_manager.notify_changed()
+
+        task = asyncio.create_task(wait_for_termination())
+        self._terminating_responses.add(task)
+        task.add_done_callback(self._terminating_responses.discard)
+
+    def start_response(self, prompt):
+        self.supersede_response()
+        self.response_id += 1
+        self.response_prompt = prompt
+        self.respond_to_prompt = RespondToPromptAsync(self.response_state_manager)
+        self.respond_to_prompt_task = asyncio.create_task(self.respond_to_prompt.run(prompt, self.prompt_manager.messages))
+        self.respond_to_prompt_task.add_done_callback(self._on_response_done)
+        response_step_obs, response_state = self.response_state_manager.reset_episode()
+
+    def _on_response_done(self, task):
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        # the TaskGroups in RespondToPromptAsync wrap what went wrong
+        while isinstance(error, BaseExceptionGroup):
+            error = error.exceptions[0]
+        print(f"Exception in respond_to_prompt_task: {error}")
+        trace = "".join(traceback.format_exception(task.exception()))
+        print(f"trace: {trace}")
+        # a superseded response failing is not news to the user
+        if task is self.respond_to_prompt_task:
+            self.add_output_to_history(f"⚠️ no response ({type(error).__name__}): {error}\n")
+            self.response_state_manager.notify_changed()
+
+    def compact_prompt(self):
+        """Summarizes chat turns the prompt budget dropped, in the background, one summary at a time."""
+        if len(self.prompt_manager.trimmed) == 0:
+            return
+        if self._compact_prompt_task is not None and not self._compact_prompt_task.done():
+            return
+        self._compact_prompt_task = asyncio.create_task(self.prompt_manager.compact_async(ActiveInferenceService().summarize_conversation))
+        self._compact_prompt_task.add_done_callback(self._on_compact_prompt_done)
+
+    def _on_compact_prompt_done(self, task):
+        if task.cancelled() or task.exception() is None:
+            return
+        # the trimmed turns stay queued, we try again after the next message
+        print(f"Exception summarizing trimmed chat turns: {task.exception()}")
+
+    async def typing_in_progress(self, data):
+        self.user_typing_feed = data
+        self.response_state_manager.notify_changed()
+
+    async def complete_sentence(self, prompt):
+        self.user_typing_feed = ""
+        response_preview_text = self.response_state_manager.pretty_print_current_responses()
+        if len(response_preview_text) > 0:
+            self.add_output_to_history(response_preview_text)
+        self.add_output_to_history(f"👨 {prompt}\n")
+        self.prompt_manager.replace_or_append_user_message(prompt)
+        self.sensory_stream.append_user_message(prompt)
+        self.start_response(prompt)
 
     def add_output_to_history(self, output):
         self.output_history.append(output)
@@ -78,11 +212,22 @@ class Main:
             else:
                 task_status = "running"
         self.debug_info.append(f"respond_to_prompt_task: {task_status}")
+        if len(self.cancellation_latencies):
+            self.debug_info.append(f"superseded responses: {self.superseded_responses}, cancel latency last {self.cancellation_latencies[-1]*1000:.0f}ms max {max(self.cancellation_latencies)*1000:.0f}ms")
+        pool_metrics = shared_pool_metrics()
+        if len(pool_metrics):
+            self.debug_info.append(f"llm pool: {pool_metrics['in_flight']} in flight, {pool_metrics['checkouts']} checkouts, {pool_metrics['reused'] if pool_metrics['reused'] is not None else 'n/a'} reused, {pool_metrics['waits']} waits")
+        if self.sensory_stream.event_log_error is not None:
+            self.debug_info.append(f"event log failed, not logging: {self.sensory_stream.event_log_error}")
+        self.debug_info.append(f"chat prompt: {self.prompt_manager.total_tokens}/{self.prompt_manager.max_prompt_tokens} tokens, {len(self.prompt_manager.messages)} messages, {self.prompt_manager.trimmed_messages} trimmed, {self.prompt_manager.summarized_messages} summarized")
+        retry_metrics = default_retry_policy().metrics()
+        retries = ", ".join(f"{count} {kind}" for kind, count in retry_metrics["retries"].items())
+        self.debug_info.append(f"llm retries: {retries}, {retry_metrics['gave_up']} gave up, {retry_metrics['circuit_fast_failures']} refused, circuit {retry_metrics['circuit_state']} (opened {retry_metrics['circuit_opened']}x)")
 
         self.debug_info.append(f"---- MetaAgent debug info ----")
         for debug_string in self.meta_agent.debug_strings:
             self.debug_info.append(debug_string)
-        await sio.emit("update_debug", self.debug_info)
+        await self.emit_delta("update_debug", "debug", self.debug_info)
 
     async def emit_chat_history(self, human_preview_text):
         list_of_strings = self.output_history.copy()
@@ -103,14 +248,16 @@ class Main:
                     chat_history.append(line)
         if len(chat_history) == 0:
             chat_history = ["...waiting..."]
-        if chat_history != self.chat_history:
-            await sio.emit("update_chat", chat_history)
+        # the channel skips unchanged lines itself, and still resends them after a resync
+        await self.emit_delta("update_chat", "chat", chat_history)
         self.chat_history = chat_history
 
     async def eval_loop(self):
         while True:
             try:
                 await self.meta_agent.step_async(self.sensory_stream)
+                # debug strings and possibly the policy changed
+                self.response_state_manager.notify_changed()
 
                 await asyncio.gather(
                     asyncio.sleep(10)
@@ -120,11 +267,13 @@ class Main:
                 print(f"Exception in eval_loop: {e}")
                 trace = traceback.format_exc()
                 print(f"trace: {trace}")
+                self.response_state_manager.notify_changed()
                 await asyncio.sleep(10)
 
     async def main_loop(self):
         prior_meta_agent_policy = None
         while True:
+            await self.response_state_manager.wait_for_change(self.update_coalesce_window)
             response_step_obs, response_state = self.response_state_manager.begin_next_step()
             should_review_meta_agent = True
             prompt = self.user_typing_feed
@@ -137,6 +286,7 @@ class Main:
                 self.prompt_manager.append_assistant_message(new_response)
                 self.sensory_stream.append_assistant_message(new_response)
                 should_review_meta_agent = False
+            self.compact_prompt()
 
             if self.respond_to_prompt_task is not None and not self.respond_to_prompt_task.done():
                 should_review_meta_agent = False
@@ -150,22 +300,88 @@ class Main:
                         self.add_output_to_history(response_preview_text)
                     # self.add_output_to_history(f"🧠 {prompt}")
 
-                    self.respond_to_prompt = RespondToPromptAsync(self.response_state_manager)
-                    self.respond_to_prompt_task = asyncio.create_task(self.respond_to_prompt.run(prompt, self.prompt_manager.messages))
-                    response_step_obs, response_state = self.response_state_manager.reset_episode()
+                    self.start_response(prompt)
 
-            await asyncio.gather(
+            emits = [
                 self.emit_chat_history(human_preview_text),
                 self.emit_debug(),
-                asyncio.sleep(1 / 30)
-            )            
+            ]
+            if len(response_step_obs.llm_responses):
+                # lets clients (e.g. _bench_chat_latency.py) tell which prompt's response the new chat lines are
+                emits.append(self.emit("response_sentences", {"response_id": self.response_id, "prompt": self.response_prompt, "count": len(response_step_obs.llm_responses)}))
+            await asyncio.gather(*emits)
+
+
+# sid -> the user id the client connected with
+user_ids = {}
+sessions = SessionRegistry(session_factory=lambda sid: Main(sid, user_id=user_ids.get(sid)))
+
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    # only ids we issued (and signed) pick up a user's history, anything else gets a new id
+    user_id = user_id_from_token(auth.get("user_token")) if isinstance(auth, dict) else None
+    if user_id is None:
+        user_id, user_token = issue_user_token()
+        await sio.emit("user_token", user_token, to=sid)
+    user_ids[sid] = user_id
+    print(f"User connected: {sid} (user {user_id})")
+    await sessions.get_or_create(sid)
+
+
+@sio.event
+async def disconnect(sid):
+    print(f"User disconnected: {sid}")
+    await sessions.evict(sid)
+    user_ids.pop(sid, None)
+
+
+async def get_session(sid):
+    """The sid's session, only connect creates one. None after it was evicted (idle or over
+    the cap), the client is told to reconnect so it gets a fresh session deliberately."""
+    main = sessions.get(sid)
+    if main is None:
+        print(f"No session for {sid}, asking the client to reconnect")
+        await sio.emit("session_expired", to=sid)
+    return main
+
+
+@sio.event
+async def typing_in_progress(sid, data):
+    main = await get_session(sid)
+    if main is not None:
+        await main.typing_in_progress(data)
+
+
+@sio.event
+async def complete_sentence(sid, prompt):
+    main = await get_session(sid)
+    if main is not None:
+        await main.complete_sentence(prompt)
+
+
+@sio.event
+async def ack_update(sid, data):
+    main = sessions.get(sid)
+    if main is not None and isinstance(data, dict):
+        main.ack_update(data.get("channel"), data.get("v"))
+
+
+@sio.event
+async def request_resync(sid, channel=None):
+    main = await get_session(sid)
+    if main is not None:
+        main.request_resync(channel)
 
 
 @app.on_event("startup")
 async def startup_event():
-    main = Main()
-    asyncio.create_task(main.main_loop())
-    asyncio.create_task(main.eval_loop())
+    sessions.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await sessions.stop()
 
 if __name__ == "__main__":
     uvicorn.run("app:sio_asgi_app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,100 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from vector_db import VectorDB
+
+
+class AsyncVectorDB:
+    """Awaitable facade over VectorDB that keeps embedding and index work off the event loop.
+
+    Calls run on a small thread pool (ONNX inference and the numpy / chroma scans release
+    the GIL). At most max_concurrency calls run at once; the rest wait their turn.
+    queue_depth counts waiting plus running calls, and once it reaches max_queue_depth
+    new calls fail fast with asyncio.QueueFull instead of piling up behind a slow index.
+
+    Without a vector_db one is built on the thread pool by initialize(), loading the
+    index, the ONNX model and the embedding cache never blocks the event loop.
+    """
+    def __init__(self, vector_db:VectorDB = None, max_concurrency=2, max_queue_depth=64):
+        self.vector_db = vector_db
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="vector_db")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # one VectorDB (and one writer to its embedding cache files) however many callers initialize at once
+        self._initialize_lock = asyncio.Lock()
+        self._initialized = False
+
+    async def _run(self, fn, *args, **kwargs):
+        if self.queue_depth >= self.max_queue_depth:
+            self.rejected += 1
+            raise asyncio.QueueFull(f"AsyncVectorDB queue is full ({self.queue_depth} calls pending).")
+        self.queue_depth += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.queue_depth -= 1
+
+    def _initialize(self):
+        if self.vector_db is None:
+            self.vector_db = VectorDB()
+        self.vector_db.initialize()
+
+    async def initialize(self):
+        async with self._initialize_lock:
+            if not self._initialized:
+                await self._run(self._initialize)
+                self._initialized = True
+
+    @property
+    def _vector_db(self) -> VectorDB:
+        assert self.vector_db is not None, "AsyncVectorDB not initialized. Call initialize() first."
+        return self.vector_db
+
+    async def search(self, query_text, n_results=5, prior_category=None, prior_type=None):
+        return await self._run(self._vector_db.search, query_text, n_results=n_results, prior_category=prior_category, prior_type=prior_type)
+
+    async def search_many(self, query_texts, n_results=5, prior_category=None, prior_type=None, dedupe=False):
+        return await self._run(self._vector_db.search_many, query_texts, n_results=n_results, prior_category=prior_category, prior_type=prior_type, dedupe=dedupe)
+
+    async def embeddings_search(self, embeddings, n_results=5, where=None):
+        return await self._run(self._vector_db.embeddings_search, embeddings, n_results=n_results, where=where)
+
+    async def get_embeddings(self, document:str):
+        return await self._run(self._vector_db.get_embeddings, document)
+
+    def metrics(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "rejected": self.rejected,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    async def main():
+        vector_db = AsyncVectorDB()
+        await vector_db.initialize()
+        queries = ["I like cabbages", "I live traveling", "I am sad"]
+        results = await asyncio.gather(*[vector_db.search(query) for query in queries])
+        for query, sorted_results in zip(queries, results):
+            print(f"'{query}' results:")
+            for i in range(len(sorted_results['ids'][0])):
+                print(f" - {sorted_results['distances'][0][i]:.5f}, '{sorted_results['documents'][0][i]}'")
+            print()
+        print(vector_db.metrics())
+        vector_db.close()
+
+    asyncio.run(main())
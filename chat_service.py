@@ -2,53 +2,36 @@ import asyncio
 import itertools
 import json
 import os
+from contextlib import aclosing
 import openai
 from openai import AsyncOpenAI
 
+from llm_client import get_shared_async_openai_client
+from llm_response_cache import LLMResponseCache, default_response_cache
+from retry_policy import RetryPolicy, default_retry_policy
+from sentence_segmenter import SentenceSegmenter
 
 
 class ChatService:
-    def __init__(self, api="openai", model_id = "gpt-3.5-turbo"):
+    def __init__(self, api="openai", model_id = "gpt-3.5-turbo", response_cache:LLMResponseCache = None, aclient:AsyncOpenAI = None, retry_policy:RetryPolicy = None):
         self._api = api
-        self._aclient = AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-        )
+        self._aclient = aclient if aclient is not None else get_shared_async_openai_client()
+        self._retry_policy = retry_policy if retry_policy is not None else default_retry_policy()
         self._model_id = model_id
+        self._response_cache = response_cache if response_cache is not None else default_response_cache()
+
+    async def _stream_text(self, request):
+        response = await self._aclient.chat.completions.create(**request)
+        try:
+            async for chunk in response:
+                chunk_text = chunk.choices[0].delta.content
+                if chunk_text:
+                    yield chunk_text
+        finally:
+            # the stream stops reading at [DONE] without closing, which would keep the
+            # connection checked out of the pool instead of returning it for reuse
+            await response.response.aclose()
 
-    def _should_we_send_to_voice(self, sentence:str):
-        sentence_termination_characters = [".", "?", "!"]
-        close_brackets = ['"', ')', ']']
-
-        if sentence is None or sentence.isspace():
-            return None
-
-        temination_charicter_present = any(c in sentence for c in sentence_termination_characters)
- 
-        # early exit if we don't have a termination character
-        if not temination_charicter_present:
-            return None
-
-        # early exit the last char is a termination character
-        if sentence[-1] in sentence_termination_characters:
-            return None
-        
-        # early exit the last char is a close bracket
-        if sentence[-1] in close_brackets:
-            return None
-        
-        termination_indices = [sentence.rfind(char) for char in sentence_termination_characters]
-        # Filter out termination indices that are not followed by whitespace or end of string
-        termination_indices = [i for i in termination_indices if sentence[i+1].isspace()]
-        if len(termination_indices) == 0:
-            return None
-        last_termination_index = max(termination_indices)
-        # handle case of close bracket
-        while last_termination_index+1 < len(sentence) and sentence[last_termination_index+1] in close_brackets:
-            last_termination_index += 1
-
-        text_to_speak = sentence[:last_termination_index+1]
-        return text_to_speak
-    
     def ignore_sentence(self, text_to_speak):
         # exit if empty, white space or an single breaket
         if text_to_speak.isspace():
@@ -61,59 +44,51 @@ class ChatService:
         return False
 
     async def get_responses_as_sentances_async(self, messages, cancel_event=None):
-        llm_response = ""
-        current_sentence = ""
-        delay = 0.1
+        segmenter = SentenceSegmenter()
+
+        request = dict(
+            model=self._model_id,
+            messages=messages,
+            temperature=1.0,  # use 0 for debugging/more deterministic results
+            stream=True
+        )
 
+        attempt = 0
         while True:
+            attempt += 1
+            probe = self._retry_policy.before_attempt(attempt)
+            yielded = False
+            reported = False
             try:
-                response = await self._aclient.chat.completions.create(
-                    model=self._model_id,
-                    messages=messages,
-                    temperature=1.0,  # use 0 for debugging/more deterministic results
-                    stream=True
-                )
-
-                async for chunk in response:
-                    if cancel_event is not None and cancel_event.is_set():
-                        return
-                    chunk_text = chunk.choices[0].delta.content
-                    if chunk_text:
-                        current_sentence += chunk_text
-                        llm_response += chunk_text
-                        text_to_speak = self._should_we_send_to_voice(current_sentence)
-                        if text_to_speak:
-                            current_sentence = current_sentence[len(text_to_speak):]
-                            yield text_to_speak, True
-                        else:
-                            yield current_sentence, False
-
+                async with aclosing(self._response_cache.stream_text(request, lambda: self._stream_text(request))) as stream:
+                    async for chunk_text in stream:
+                        if cancel_event is not None and cancel_event.is_set():
+                            return
+                        if chunk_text:
+                            yielded = True
+                            sentences = segmenter.feed(chunk_text)
+                            for sentence in sentences:
+                                yield sentence, True
+                            if len(sentences) == 0:
+                                yield segmenter.pending, False
+
+                reported = True
+                self._retry_policy.on_success()
                 if cancel_event is not None and cancel_event.is_set():
                     return
-                if len(current_sentence) > 0:
-                    yield current_sentence, True
+                remainder = segmenter.flush()
+                if len(remainder) > 0:
+                    yield remainder, True
                 return
 
-            except openai.APIError as e:
-                print(f"OpenAI API returned an API Error: {e}")
-                print(f"Retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
-                delay *= 2
-
-            # except openai.error.APIConnectionError as e:
-            #     print(f"Failed to connect to OpenAI API: {e}")
-            #     print(f"Retrying in {delay} seconds...")
-            #     await asyncio.sleep(delay)
-            #     delay *= 2
-
-            # except openai.error.RateLimitError as e:
-            #     print(f"OpenAI API request exceeded rate limit: {e}")
-            #     print(f"Retrying in {delay} seconds...")
-            #     await asyncio.sleep(delay)
-            #     delay *= 2
-
             except Exception as e:
-                print(f"OpenAI API unknown error: {e}")
-                print(f"Retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
-                delay *= 2
\ No newline at end of file
+                reported = True
+                # once part of the response has been shown, a retry would repeat it
+                delay = self._retry_policy.on_error(e, attempt, retryable=not yielded)
+                print(f"OpenAI API error ({self._retry_policy.classify(e)}, attempt {attempt}/{self._retry_policy.max_attempts}): {e}")
+                print(f"Retrying in {delay:.2f} seconds...")
+            finally:
+                if not reported:
+                    # cancelled (or closed) mid stream, don't leave a half open circuit waiting on us
+                    self._retry_policy.on_abandon(probe)
+            await asyncio.sleep(delay)
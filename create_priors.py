@@ -124,50 +124,26 @@ The response should be in the form of a json list:
 import os
 import openai
 from openai import AsyncOpenAI
+from llm_client import get_shared_async_openai_client
+from retry_policy import default_retry_policy
 
-aclient = AsyncOpenAI(
-    api_key = os.getenv("OPENAI_API_KEY")
-)
+aclient = get_shared_async_openai_client()
 # model_id = "gpt-3.5-turbo"
 model_id = "gpt-4"
 
 
 async def create_catogory_async(messages):
-    delay = 1
-    while True:
-        try:
-            response = await aclient.chat.completions.create(
-                model=model_id,
-                messages=messages,
-                temperature=1.0,
-                stream=False
-            )
-            break
-
-        except openai.APIError as e:
-            print(f"OpenAI API returned an API Error: {e}")
-            print(f"Retrying in {delay} seconds...")
-
-        except openai.error.APIConnectionError as e:
-            print(f"Failed to connect to OpenAI API: {e}")
-            print(f"Retrying in {delay} seconds...")
-
-        except openai.error.RateLimitError as e:
-            print(f"OpenAI API request exceeded rate limit: {e}")
-            print(f"Retrying in {delay} seconds...")
-
-        except Exception as e:
-            print(f"OpenAI API unknown error: {e}")
-            trace = traceback.format_exc()
-            print(f"trace: {trace}")
-            print(f"Retrying in {delay} seconds...")
-
-        await asyncio.sleep(delay)
-        delay *= 2
-
-    output =  response.choices[0].message
-    output_json = json.loads(output.content)
-    return output_json
+    async def attempt():
+        response = await aclient.chat.completions.create(
+            model=model_id,
+            messages=messages,
+            temperature=1.0,
+            stream=False
+        )
+        output =  response.choices[0].message
+        return json.loads(output.content)
+
+    return await default_retry_policy().call(attempt)
 
 async def run_catogory_async(categories, file_name):
     items = {}
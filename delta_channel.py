@@ -0,0 +1,57 @@
+class DeltaChannel:
+    """Versioned list-of-lines sync for one client.
+
+    Each update is a splice against the previous version: keep the first `start` lines and
+    the last `keep_tail` lines of the client's copy and put `lines` in between. The client
+    acks the versions it applies; if it falls too far behind, or asks for a resync, the next
+    update carries the full list instead.
+
+    update payload: {"v", "base", "full", "start", "keep_tail", "lines"}
+    """
+    def __init__(self, name, max_unacked=8):
+        self.name = name
+        self.max_unacked = max_unacked
+        self.version = 0
+        self.acked_version = 0
+        self.lines = None
+
+    def resync(self):
+        self.lines = None
+
+    def ack(self, version):
+        if isinstance(version, int) and self.acked_version < version <= self.version:
+            self.acked_version = version
+
+    def make_update(self, lines):
+        lines = list(lines)
+        if self.lines is not None and lines == self.lines:
+            return None
+        full = self.lines is None or self.version - self.acked_version >= self.max_unacked
+        start = 0
+        keep_tail = 0
+        if not full:
+            old = self.lines
+            max_common = min(len(old), len(lines))
+            while start < max_common and old[start] == lines[start]:
+                start += 1
+            max_tail = max_common - start
+            while keep_tail < max_tail and old[-1 - keep_tail] == lines[-1 - keep_tail]:
+                keep_tail += 1
+        base = self.version
+        self.version += 1
+        self.lines = lines
+        return {
+            "v": self.version,
+            "base": base,
+            "full": full,
+            "start": start,
+            "keep_tail": keep_tail,
+            "lines": lines[start:len(lines) - keep_tail],
+        }
+
+
+def apply_update(lines, update):
+    """Client side of DeltaChannel.make_update, returns the new list of lines."""
+    if update["full"]:
+        return list(update["lines"])
+    return lines[:update["start"]] + update["lines"] + lines[len(lines) - update["keep_tail"]:]
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class EmbeddingCache:
+    """Content addressed embedding cache, an in-memory LRU in front of an on-disk store.
+
+    On disk each model gets three files in `path`:
+     - {model}.json  - {"dim": embedding size}
+     - {model}.keys  - one key per line, line n is row n of the vectors file
+     - {model}.f32   - float32 rows, read through a memory map
+
+    Both files are append only. Vectors are written before their keys, so a crash can
+    leave orphan rows but never a key without a vector.
+    """
+    def __init__(self, path, model_name, lru_size=4096):
+        self.path = path
+        self.model_name = model_name
+        self.lru_size = lru_size
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._rows = {}
+        self._dim = None
+        self._mmap = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        file_stem = os.path.join(path, model_name.replace("/", "_"))
+        self._meta_path = f"{file_stem}.json"
+        self._keys_path = f"{file_stem}.keys"
+        self._vectors_path = f"{file_stem}.f32"
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as json_file:
+            self._dim = json.load(json_file)["dim"]
+        row_count = 0
+        if os.path.exists(self._vectors_path):
+            row_count = os.path.getsize(self._vectors_path) // (self._dim * 4)
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path) as keys_file:
+                for row, key in enumerate(keys_file):
+                    if row >= row_count:
+                        break
+                    self._rows[key.strip()] = row
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _read_row(self, row):
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            row_count = os.path.getsize(self._vectors_path) // (self._dim * 4)
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(row_count, self._dim))
+        return np.array(self._mmap[row])
+
+    def _remember(self, key, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _append(self, keys, vectors):
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+            with open(self._meta_path, "w") as json_file:
+                json.dump({"dim": self._dim}, json_file)
+        # drop any orphan rows left by an interrupted write so rows and keys stay aligned
+        row_count = len(self._rows)
+        with open(self._vectors_path, "ab") as vectors_file:
+            vectors_file.truncate(row_count * self._dim * 4)
+            vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._keys_path, "a") as keys_file:
+            keys_file.write("".join(f"{key}\n" for key in keys))
+        for i, key in enumerate(keys):
+            self._rows[key] = row_count + i
+        self._mmap = None
+
+    def get_many(self, texts, embed_fn):
+        """Returns a float32 array with one row per text, calling embed_fn only for unseen texts."""
+        texts = list(texts)
+        keys = [self.key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = OrderedDict()
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    vectors[i] = self._lru[key]
+                    self.hits += 1
+                elif key in self._rows:
+                    vectors[i] = self._read_row(self._rows[key])
+                    self._remember(key, vectors[i])
+                    self.disk_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+        if len(missing):
+            missing_texts = [texts[indices[0]] for indices in missing.values()]
+            computed = np.asarray(embed_fn(missing_texts), dtype=np.float32)
+            with self._lock:
+                new_keys = [key for key in missing.keys() if key not in self._rows]
+                new_vectors = [computed[j] for j, key in enumerate(missing.keys()) if key not in self._rows]
+                if len(new_keys):
+                    self._append(new_keys, np.stack(new_vectors))
+                for j, (key, indices) in enumerate(missing.items()):
+                    self._remember(key, computed[j])
+                    for i in indices:
+                        vectors[i] = computed[j]
+                self.misses += len(missing)
+        if len(vectors) == 0:
+            return np.zeros((0, self._dim or 0), dtype=np.float32)
+        return np.stack(vectors)
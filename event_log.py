@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+
+from sensory_stream import SensoryStream, iso_time_stamp
+
+
+class EventLogWriter:
+    """Append-only JSONL log of sensory stream events, one {"t", "iso", "event"} object per line.
+
+    append() only puts the record on a queue, so it never blocks the event loop. A
+    background thread group-commits: it takes everything queued (waiting up to
+    commit_interval for more to arrive, at most max_batch records), writes it in one go
+    and fsyncs once per batch. A crash loses at most the batch in flight; a torn last
+    line is skipped by the reader, and cut off when the log is opened again so new
+    records start on a line of their own.
+
+    If the writer thread fails (disk full, file gone, ...) the error is kept and raised
+    by the next append() or close(), later records are not silently queued and lost.
+    """
+    def __init__(self, path, commit_interval=0.05, max_batch=512, fsync=True):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.records_written = 0
+        self.batches = 0
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self.error = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "ab")
+        self._truncate_torn_line()
+        self._thread = threading.Thread(target=self._run, name=f"EventLogWriter({os.path.basename(path)})", daemon=True)
+        self._thread.start()
+
+    def _truncate_torn_line(self, block_size=1 << 16):
+        end = self._file.seek(0, os.SEEK_END)
+        position = end
+        with open(self.path, "rb") as log_file:
+            while position > 0:
+                start = max(0, position - block_size)
+                log_file.seek(start)
+                newline = log_file.read(position - start).rfind(b"\n")
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+        if position < end:
+            print(f"Event log {self.path}: dropping a torn last line of {end - position} bytes")
+            self._file.truncate(position)
+
+    def append(self, event:str, time_stamp:float):
+        assert not self._closed, "event log is closed"
+        if self.error is not None:
+            raise self.error
+        self._queue.put((time_stamp, event))
+
+    def flush(self):
+        """Blocks until everything appended so far is on disk (or the writer has failed)."""
+        written = threading.Event()
+        self._queue.put(written)
+        while not written.wait(0.1):
+            if self.error is not None or self._closed:
+                return
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.commit_interval
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            self._write_batches()
+        except BaseException as e:
+            self.error = e
+            print(f"Event log {self.path}: writer failed, no more events are logged: {e}")
+            self._file.close()
+
+    def _write_batches(self):
+        while True:
+            batch = self._next_batch()
+            records = [record for record in batch if isinstance(record, tuple)]
+            if len(records):
+                lines = [json.dumps({"t": time_stamp, "iso": iso_time_stamp(time_stamp), "event": event}, ensure_ascii=False) for time_stamp, event in records]
+                self._file.write(("\n".join(lines) + "\n").encode("utf-8"))
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                self.records_written += len(records)
+                self.batches += 1
+            for record in batch:
+                if isinstance(record, threading.Event):
+                    record.set()
+            if batch[-1] is None:
+                self._file.close()
+                return
+
+    def close(self):
+        """Commits whatever is queued and stops the writer thread. Blocks, call it with asyncio.to_thread from async code."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def metrics(self):
+        return {"records_written": self.records_written, "batches": self.batches, "queued": self._queue.qsize(), "failed": self.error is not None}
+
+
+_user_token_secret = None
+
+def _token_secret() -> bytes:
+    global _user_token_secret
+    if _user_token_secret is None:
+        secret = os.getenv("AGENT_LAB_USER_TOKEN_SECRET")
+        if secret:
+            _user_token_secret = secret.encode("utf-8")
+        else:
+            print("AGENT_LAB_USER_TOKEN_SECRET is not set, user tokens will not be valid after a restart")
+            _user_token_secret = secrets.token_bytes(32)
+    return _user_token_secret
+
+
+def _sign(user_id:str) -> str:
+    return hmac.new(_token_secret(), user_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def issue_user_token():
+    """A new (user_id, token) pair. The client keeps the token and sends it back, user ids are never taken from the client as is."""
+    user_id = secrets.token_hex(16)
+    return user_id, f"{user_id}.{_sign(user_id)}"
+
+
+def user_id_from_token(token) -> str:
+    """The user id a token was issued for, None if it was not signed by us (AGENT_LAB_USER_TOKEN_SECRET)."""
+    if not isinstance(token, str) or token.count(".") != 1:
+        return None
+    user_id, signature = token.split(".")
+    if not hmac.compare_digest(signature, _sign(user_id)):
+        return None
+    return user_id
+
+
+def event_log_path(user_id:str) -> str:
+    """Where a user's log lives in AGENT_LAB_EVENT_LOG_DIR, None when that is not set or
+    there is no usable user id."""
+    log_dir = os.getenv("AGENT_LAB_EVENT_LOG_DIR")
+    if not log_dir or not user_id:
+        return None
+    # issued ids are hex already, this only keeps anything else to a safe file name
+    safe_user_id = re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)[:128].lstrip(".")
+    if not len(safe_user_id):
+        print(f"Unusable user id for an event log: {user_id!r}, not logging")
+        return None
+    return os.path.join(log_dir, f"{safe_user_id}.jsonl")
+
+
+class _UserLog:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.writer = None
+        # sessions appending to writer
+        self.streams = 0
+        # coroutines holding or waiting for lock
+        self.users = 0
+
+
+# user id -> _UserLog, one writer per user however many sessions (tabs) they have open
+_user_logs = {}
+
+
+@contextlib.asynccontextmanager
+async def _locked_user_log(user_id):
+    user_log = _user_logs.setdefault(user_id, _UserLog())
+    user_log.users += 1
+    try:
+        async with user_log.lock:
+            yield user_log
+    finally:
+        user_log.users -= 1
+        if user_log.users == 0 and user_log.writer is None:
+            del _user_logs[user_id]
+
+
+async def open_user_stream(user_id:str, capacity=None) -> SensoryStream:
+    """The user's SensoryStream, rebuilt from the tail of their log, logging new events to
+    the writer shared by all of the user's sessions. A plain, unlogged stream when logging
+    is off or user_id is None (only pass ids from user_id_from_token or issue_user_token).
+
+    The log is read and opened in a thread, off the event loop. Pair every call with
+    close_user_stream."""
+    path = event_log_path(user_id)
+    if path is None:
+        return SensoryStream(capacity=capacity)
+    async with _locked_user_log(user_id) as user_log:
+        # the lock also waits out a close_user_stream still flushing this user's last session
+        if user_log.writer is not None:
+            # another session of the user is logging, get what it has queued on disk first
+            await asyncio.to_thread(user_log.writer.flush)
+        if os.path.exists(path):
+            stream = await asyncio.to_thread(rebuild_stream, path, capacity)
+        else:
+            stream = SensoryStream(capacity=capacity)
+        if user_log.writer is None:
+            user_log.writer = await asyncio.to_thread(EventLogWriter, path)
+        user_log.streams += 1
+        stream.event_log = user_log.writer
+    return stream
+
+
+async def close_user_stream(user_id:str):
+    """Ends a session's use of the user's log (see open_user_stream), the last one closes the writer."""
+    if event_log_path(user_id) is None or user_id not in _user_logs:
+        return
+    async with _locked_user_log(user_id) as user_log:
+        if user_log.writer is None:
+            return
+        user_log.streams -= 1
+        if user_log.streams == 0:
+            writer, user_log.writer = user_log.writer, None
+            await asyncio.to_thread(writer.close)
+
+
+def read_events(path, last=None):
+    """Yields (event, time_stamp) from a log, reading it through mmap, only the last `last`
+    lines when given. Stops at a torn last line, skips corrupt ones."""
+    with open(path, "rb") as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if last is not None:
+                # walk back from the end of the last complete line
+                newline = mm.rfind(b"\n")
+                start = 0
+                for _ in range(last):
+                    if newline < 0:
+                        start = 0
+                        break
+                    newline = mm.rfind(b"\n", 0, newline)
+                    start = newline + 1
+                mm.seek(start)
+            for line in iter(mm.readline, b""):
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Event log {path}: skipping a corrupt line")
+                    continue
+                yield record["event"], record["t"]
+
+
+def rebuild_stream(path, capacity=None) -> SensoryStream:
+    """The SensoryStream as it was when the log ended. Only the last capacity lines are read,
+    older events would be evicted anyway (they are not summarized)."""
+    stream = SensoryStream(capacity=capacity)
+    for event, time_stamp in read_events(path, last=stream.capacity):
+        stream.append_event(event, time_stamp)
+    return stream
+
+
+async def replay(path, main, speed=1.):
+    """Feeds a logged session into an app.Main, keeping the original gaps divided by speed
+    (speed <= 0 replays as fast as possible). User messages go through complete_sentence,
+    like a user typing them; assistant messages are left for the app to generate again;
+    anything else is appended to the sensory stream as is."""
+    start_time = time.monotonic()
+    first_time_stamp = None
+    for event, time_stamp in read_events(path):
+        if first_time_stamp is None:
+            first_time_stamp = time_stamp
+        if speed > 0:
+            to_wait = (time_stamp - first_time_stamp) / speed - (time.monotonic() - start_time)
+            if to_wait > 0:
+                await asyncio.sleep(to_wait)
+        if event.startswith("User: "):
+            await main.complete_sentence(event[len("User: "):])
+        elif not event.startswith("Assistant: "):
+            main.sensory_stream.append_event(event)
+
+
+async def _replay_main(path, speed, settle):
+    from app import Main
+    main = Main(f"replay-{os.path.basename(path)}")
+    await main.start()
+    try:
+        await replay(path, main, speed)
+        await asyncio.sleep(settle)
+    finally:
+        await main.stop()
+    print("\n".join(main.chat_history))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild or replay a sensory stream event log.")
+    parser.add_argument("command", choices=["rebuild", "replay"])
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1., help="replay speed multiplier, 0 for as fast as possible")
+    parser.add_argument("--settle", type=float, default=5., help="seconds to let the last response finish")
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        print(rebuild_stream(args.path).pritty_print())
+    else:
+        asyncio.run(_replay_main(args.path, args.speed, args.settle))
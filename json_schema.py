@@ -1,8 +1,7 @@
 # ref: https://github.com/langchain-ai/langchain/blob/940b9ae30ace7d57fff1e98275bc5e4e254b0675/libs/langchain/langchain/utils/json_schema.py#L58
 from __future__ import annotations
 
-from copy import deepcopy
-from typing import Any, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Set
 
 
 def _retrieve_ref(path: str, schema: dict) -> dict:
@@ -15,44 +14,82 @@ def _retrieve_ref(path: str, schema: dict) -> dict:
     out = schema
     for component in components[1:]:
         out = out[component]
-    return deepcopy(out)
+    # callers never mutate what they get back, so there is no need to copy
+    return out
 
 
-def _dereference_refs_helper(
-    obj: Any, full_schema: dict, skip_keys: Sequence[str]
-) -> Any:
-    if isinstance(obj, dict):
-        obj_out = {}
-        for k, v in obj.items():
-            if k in skip_keys:
-                obj_out[k] = v
-            elif k == "$ref":
-                ref = _retrieve_ref(v, full_schema)
-                return _dereference_refs_helper(ref, full_schema, skip_keys)
-            elif isinstance(v, (list, dict)):
-                obj_out[k] = _dereference_refs_helper(v, full_schema, skip_keys)
-            else:
-                obj_out[k] = v
-        return obj_out
-    elif isinstance(obj, list):
-        return [_dereference_refs_helper(el, full_schema, skip_keys) for el in obj]
-    else:
-        return obj
+class _Dereferencer:
+    """Inlines $refs, resolving each definition once.
+
+    Resolved definitions are memoized and the same object is reused at every site that
+    refers to it, and any subtree without a $ref in it is returned as is rather than
+    rebuilt. The output therefore shares structure with the input and with itself, so
+    treat both as read only. A $ref that points back at a definition still being
+    resolved is left in place, so recursive models terminate.
+    """
 
+    def __init__(self, full_schema: dict, skip_keys: Sequence[str]):
+        self.full_schema = full_schema
+        self.skip_keys = set(skip_keys)
+        self.resolved: Dict[str, Any] = {}
+        self.resolving: Set[str] = set()
 
-def _infer_skip_keys(obj: Any, full_schema: dict) -> List[str]:
+    def resolve(self, path: str) -> Any:
+        if path in self.resolved:
+            return self.resolved[path]
+        if path in self.resolving:
+            return {"$ref": path}
+        self.resolving.add(path)
+        try:
+            out = self.walk(_retrieve_ref(path, self.full_schema))
+        finally:
+            self.resolving.discard(path)
+        self.resolved[path] = out
+        return out
+
+    def walk(self, obj: Any) -> Any:
+        if isinstance(obj, dict):
+            if "$ref" in obj and "$ref" not in self.skip_keys:
+                return self.resolve(obj["$ref"])
+            obj_out = None
+            for k, v in obj.items():
+                if k in self.skip_keys or not isinstance(v, (list, dict)):
+                    continue
+                v_out = self.walk(v)
+                if v_out is not v:
+                    if obj_out is None:
+                        obj_out = dict(obj)
+                    obj_out[k] = v_out
+            return obj if obj_out is None else obj_out
+        elif isinstance(obj, list):
+            obj_out = None
+            for i, el in enumerate(obj):
+                el_out = self.walk(el)
+                if el_out is not el:
+                    if obj_out is None:
+                        obj_out = list(obj)
+                    obj_out[i] = el_out
+            return obj if obj_out is None else obj_out
+        else:
+            return obj
+
+
+def _infer_skip_keys(obj: Any, full_schema: dict, seen_refs: Optional[Set[str]] = None) -> List[str]:
+    seen_refs = set() if seen_refs is None else seen_refs
     keys = []
     if isinstance(obj, dict):
         for k, v in obj.items():
             if k == "$ref":
-                ref = _retrieve_ref(v, full_schema)
+                if v in seen_refs:
+                    continue
+                seen_refs.add(v)
                 keys.append(v.split("/")[1])
-                keys += _infer_skip_keys(ref, full_schema)
+                keys += _infer_skip_keys(_retrieve_ref(v, full_schema), full_schema, seen_refs)
             elif isinstance(v, (list, dict)):
-                keys += _infer_skip_keys(v, full_schema)
+                keys += _infer_skip_keys(v, full_schema, seen_refs)
     elif isinstance(obj, list):
         for el in obj:
-            keys += _infer_skip_keys(el, full_schema)
+            keys += _infer_skip_keys(el, full_schema, seen_refs)
     return keys
 
 
@@ -62,7 +99,11 @@ def dereference_refs(
     full_schema: Optional[dict] = None,
     skip_keys: Optional[Sequence[str]] = None,
 ) -> dict:
-    """Try to substitute $refs in JSON Schema."""
+    """Try to substitute $refs in JSON Schema.
+
+    The result shares unchanged subtrees with schema_obj; only its top level dict is
+    guaranteed to be new, so callers may pop keys from it but should not edit deeper.
+    """
 
     full_schema = full_schema or schema_obj
     skip_keys = (
@@ -70,4 +111,5 @@ def dereference_refs(
         if skip_keys is not None
         else _infer_skip_keys(schema_obj, full_schema)
     )
-    return _dereference_refs_helper(schema_obj, full_schema, skip_keys)
\ No newline at end of file
+    out = _Dereferencer(full_schema, skip_keys).walk(schema_obj)
+    return dict(out) if isinstance(out, dict) else out
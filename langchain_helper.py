@@ -1,6 +1,6 @@
 
 import json
-from typing import Callable, Optional, Type, TypedDict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type, TypedDict
 
 from pydantic import BaseModel
 from json_schema import dereference_refs
@@ -37,8 +37,59 @@ def convert_pydantic_to_openai_function(
             },      
     }
 
+class CompiledTools(TypedDict):
+    """OpenAI tool specs for a list of pydantic classes, built once and reused."""
+
+    openai_functions: List[FunctionDescription]
+    """The tool dicts, in the same order as the classes."""
+    fn_names: List[str]
+    """The tool names, in the same order as the classes."""
+    classes_by_name: Dict[str, Type[BaseModel]]
+    """Maps a tool name back to its pydantic class."""
+
+
+# keyed by where a class is defined rather than by the class itself, so redefining a
+# class (e.g. on module reload) replaces its entry instead of leaking the old one
+_compiled_functions: Dict[tuple, Tuple[Type[BaseModel], FunctionDescription]] = {}
+_compiled_tools: Dict[tuple, Tuple[Tuple[Type[BaseModel], ...], CompiledTools]] = {}
+
+
+def compile_openai_function(
+    model: Type[BaseModel],
+    *,
+    name: Optional[str] = None,
+    description: Optional[str] = None
+) -> FunctionDescription:
+    """Memoized convert_pydantic_to_openai_function. The result is shared, treat it as read only."""
+    key = (model.__module__, model.__qualname__, name, description)
+    cached = _compiled_functions.get(key)
+    if cached is not None and cached[0] is model:
+        return cached[1]
+    openai_function = convert_pydantic_to_openai_function(model, name=name, description=description)
+    _compiled_functions[key] = (model, openai_function)
+    return openai_function
+
+
+def compile_tools(functions: Sequence[Type[BaseModel]]) -> CompiledTools:
+    """Memoized tool specs and name map for a list of pydantic classes. The result is shared, treat it as read only."""
+    functions = tuple(functions)
+    key = tuple((f.__module__, f.__qualname__) for f in functions)
+    cached = _compiled_tools.get(key)
+    if cached is not None and all(a is b for a, b in zip(cached[0], functions)):
+        return cached[1]
+    openai_functions = [compile_openai_function(f) for f in functions]
+    fn_names = [oai_fn["function"]["name"] for oai_fn in openai_functions]
+    compiled: CompiledTools = {
+        "openai_functions": openai_functions,
+        "fn_names": fn_names,
+        "classes_by_name": dict(zip(fn_names, functions)),
+    }
+    _compiled_tools[key] = (functions, compiled)
+    return compiled
+
+
 def create_instance_from_response(response:ChatCompletionMessage, functions: [Callable]):
-    available_functions = {cls.__name__: cls for cls in functions}
+    available_functions = compile_tools(functions)["classes_by_name"]
     if response.tool_calls is None:
         print("No function call in the response.")
         return
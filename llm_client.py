@@ -0,0 +1,169 @@
+import asyncio
+import os
+import weakref
+import httpx
+from openai import AsyncOpenAI
+
+
+class _MeteredByteStream(httpx.AsyncByteStream):
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """Wraps a transport and counts how its connection pool is used.
+
+     - checkouts: requests sent, a connection is held until the response body is closed
+     - waits: checkouts made while max_connections were already in flight, i.e. that queued for a connection
+     - connections_opened / reused: whether the request needed a new TCP connection (from httpcore's trace
+       events, so only for requests the wrapped transport traced; reused is None when it traces nothing, e.g. the fake backend)
+    """
+    def __init__(self, transport:httpx.AsyncBaseTransport, max_connections=None):
+        self._transport = transport
+        self.max_connections = max_connections
+        self.checkouts = 0
+        self.waits = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.connections_opened = 0
+        self.traced = 0
+
+    @property
+    def reused(self):
+        if self.traced == 0:
+            return None
+        return self.traced - self.connections_opened
+
+    def metrics(self):
+        return {
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "connections_opened": self.connections_opened,
+            "traced": self.traced,
+            "reused": self.reused,
+            "max_connections": self.max_connections,
+        }
+
+    def _release(self):
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.checkouts += 1
+        if self.max_connections is not None and self.in_flight >= self.max_connections:
+            self.waits += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        outer_trace = request.extensions.get("trace")
+        traced = False
+
+        async def trace(event_name, info):
+            nonlocal traced
+            if not traced:
+                traced = True
+                self.traced += 1
+            if event_name == "connection.connect_tcp.started":
+                self.connections_opened += 1
+            if outer_trace is not None:
+                await outer_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._release()
+            raise
+        if response.is_closed:
+            # a body the transport already read (Response(content=...), error responses) is never closed again
+            self._release()
+        else:
+            response.stream = _MeteredByteStream(response.stream, self._release)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv("AGENT_LAB_LLM_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("AGENT_LAB_LLM_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("AGENT_LAB_LLM_KEEPALIVE_EXPIRY", "30")),
+    )
+
+
+def create_async_openai_client() -> AsyncOpenAI:
+    """AsyncOpenAI client for the backend chosen by AGENT_LAB_LLM_BACKEND.
+
+    "openai" (default) talks to the real API with OPENAI_API_KEY. "fake" routes every
+    request to local_llm_backend.FakeChatCompletionsTransport so the app runs offline;
+    see FakeChatCompletionsTransport.from_env for its AGENT_LAB_FAKE_LLM_* settings.
+
+    The client owns a keep-alive connection pool sized by AGENT_LAB_LLM_MAX_CONNECTIONS,
+    AGENT_LAB_LLM_MAX_KEEPALIVE and AGENT_LAB_LLM_KEEPALIVE_EXPIRY, metered by a
+    MeteredTransport (client._client._transport). Prefer get_shared_async_openai_client.
+
+    The client does not retry on its own, retry_policy.RetryPolicy does that for every caller.
+    """
+    backend = os.getenv("AGENT_LAB_LLM_BACKEND", "openai")
+    limits = _pool_limits()
+    if backend == "fake":
+        from local_llm_backend import FakeChatCompletionsTransport
+        transport = MeteredTransport(FakeChatCompletionsTransport.from_env(), max_connections=limits.max_connections)
+        return AsyncOpenAI(
+            api_key="fake",
+            base_url="http://fake-openai.local/v1",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=transport),
+        )
+    assert backend == "openai", f"Unknown LLM backend: {backend}"
+    transport = MeteredTransport(httpx.AsyncHTTPTransport(limits=limits), max_connections=limits.max_connections)
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(600., connect=5.)),
+    )
+
+
+# httpx clients are bound to the event loop they first run on, so share one per loop
+_shared_clients = weakref.WeakKeyDictionary()
+_shared_client_without_loop = None
+
+def get_shared_async_openai_client() -> AsyncOpenAI:
+    """The process wide client (one per event loop) that every service should use, so
+    keep-alive connections and TLS sessions survive from one request to the next."""
+    global _shared_client_without_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        if _shared_client_without_loop is None:
+            _shared_client_without_loop = create_async_openai_client()
+        return _shared_client_without_loop
+    if loop not in _shared_clients:
+        _shared_clients[loop] = create_async_openai_client()
+    return _shared_clients[loop]
+
+
+def shared_pool_metrics() -> dict:
+    """MeteredTransport.metrics() for the shared client of the running loop, {} if there is none yet."""
+    try:
+        client = _shared_clients.get(asyncio.get_running_loop())
+    except RuntimeError:
+        client = _shared_client_without_loop
+    if client is None:
+        return {}
+    return client._client._transport.metrics()
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import aclosing
+from openai.types.chat import ChatCompletionMessage
+
+
+class LLMResponseCache:
+    """On-disk cache of chat completion responses, keyed by a hash of the request.
+
+    modes:
+     - "off": every call goes to the API
+     - "record": every call goes to the API and the response is written to the cache
+     - "replay": cached responses are served, misses go to the API and are recorded
+     - "replay_strict": cached responses are served, misses raise LookupError (no network)
+
+    Streamed responses are stored as [seconds since request, text] chunks and replayed
+    with the same timing, so latency measurements still mean something. Entries are one
+    json file each; once the directory is over max_bytes the least recently used are removed.
+    """
+    modes = ("off", "record", "replay", "replay_strict")
+
+    def __init__(self, path=None, mode=None, max_bytes=None):
+        self.path = path or os.getenv("AGENT_LAB_LLM_CACHE_DIR", os.path.join(".", "llm_cache"))
+        self.mode = mode or os.getenv("AGENT_LAB_LLM_CACHE", "off")
+        assert self.mode in self.modes, f"Unknown LLM cache mode: {self.mode}, expected one of {self.modes}"
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv("AGENT_LAB_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None
+
+    @property
+    def reading(self):
+        return self.mode in ("replay", "replay_strict")
+
+    @property
+    def writing(self):
+        return self.mode in ("record", "replay")
+
+    def request_key(self, request: dict) -> str:
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def _read(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path) as json_file:
+                entry = json.load(json_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # bump the mtime so eviction is least recently used rather than oldest written
+        os.utime(entry_path)
+        return entry
+
+    def _write(self, key, entry):
+        os.makedirs(self.path, exist_ok=True)
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.tmp"
+        with open(tmp_path, "w") as json_file:
+            json.dump(entry, json_file)
+        old_size = os.path.getsize(entry_path) if os.path.exists(entry_path) else 0
+        os.replace(tmp_path, entry_path)
+        if self._total_bytes is not None:
+            self._total_bytes += os.path.getsize(entry_path) - old_size
+        self._evict()
+
+    def _evict(self):
+        if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+            return
+        entries = []
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".json"):
+                stat = os.stat(os.path.join(self.path, file_name))
+                entries.append((stat.st_mtime, stat.st_size, file_name))
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.path, file_name))
+            self._total_bytes -= size
+
+    def discard(self, request: dict):
+        """Drop a cached response, e.g. one that failed validation, so it is not replayed again."""
+        if self.mode == "off":
+            return
+        try:
+            os.remove(self._entry_path(self.request_key(request)))
+            self._total_bytes = None
+        except FileNotFoundError:
+            pass
+
+    def _lookup(self, request, kind):
+        # hash now, callers may go on to mutate their messages list while we wait on the API
+        key = self.request_key(request)
+        if not self.reading:
+            return key, None
+        entry = self._read(key)
+        if entry is not None and entry.get("kind") == kind:
+            self.hits += 1
+            return key, entry
+        self.misses += 1
+        if self.mode == "replay_strict":
+            raise LookupError(f"No cached {kind} response for request {key}")
+        return key, None
+
+    async def get_message(self, request: dict, create_fn) -> ChatCompletionMessage:
+        """Cached version of `await create_fn()` for a non streamed request."""
+        if self.mode == "off":
+            return await create_fn()
+        key, entry = self._lookup(request, "message")
+        if entry is not None:
+            return ChatCompletionMessage.model_validate(entry["message"])
+        message = await create_fn()
+        if self.writing:
+            self._write(key, {"kind": "message", "message": message.model_dump(exclude_none=True)})
+        return message
+
+    async def stream_text(self, request: dict, stream_fn):
+        """Cached version of `async for text in stream_fn()` for a streamed request."""
+        if self.mode == "off":
+            async with aclosing(stream_fn()) as stream:
+                async for text in stream:
+                    yield text
+            return
+        key, entry = self._lookup(request, "stream")
+        start_time = time.monotonic()
+        if entry is not None:
+            for offset, text in entry["chunks"]:
+                to_wait = offset - (time.monotonic() - start_time)
+                if to_wait > 0:
+                    await asyncio.sleep(to_wait)
+                yield text
+            return
+        chunks = []
+        # closing the stream as soon as we are closed hands the connection back straight away
+        async with aclosing(stream_fn()) as stream:
+            async for text in stream:
+                chunks.append([time.monotonic() - start_time, text])
+                yield text
+        # only reached when the stream ran to completion, partial streams are never cached
+        if self.writing:
+            self._write(key, {"kind": "stream", "chunks": chunks})
+
+
+_default_response_cache = None
+
+def default_response_cache() -> LLMResponseCache:
+    """Process wide cache configured from AGENT_LAB_LLM_CACHE* environment variables."""
+    global _default_response_cache
+    if _default_response_cache is None:
+        _default_response_cache = LLMResponseCache()
+    return _default_response_cache
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+import httpx
+
+
+sample_sentences = [
+    "I am Charles Petrescu.",
+    "It's... lovely to meet you.",
+    "I am your friend.",
+    "The heaviest cabbage ever found was 62.71 kilograms.",
+    "Horses and helicopters, please.",
+    "I want to go to Honolulu.",
+    "How far does the outside go?",
+    "Perilous. So very perilous.",
+    "Can birds do what they like?",
+    "Ooh, cabbages.",
+    "Could I just have a little walk around the garden?",
+    "What is your name, friend?",
+]
+
+
+class FakeByteStream(httpx.AsyncByteStream):
+    def __init__(self, parts):
+        self._parts = parts
+
+    async def __aiter__(self):
+        async for part in self._parts:
+            yield part
+
+    async def aclose(self):
+        await self._parts.aclose()
+
+
+class FakeChatCompletionsTransport(httpx.AsyncBaseTransport):
+    """Stands in for the OpenAI chat completions endpoint, no network involved.
+
+    Plug it into AsyncOpenAI through http_client=httpx.AsyncClient(transport=...). Replies
+    are generated locally: plain prompts get a few Charles-style sentences (a json list of
+    them if the system prompt asks for one), tool calls get arguments built from the tool's
+    json schema so they validate against select_policy_fn, track_policy_progress_fn and
+    update_generative_model_fn.
+
+    time_to_first_token and tokens_per_second shape the latency; error_rate and
+    rate_limit_rate inject 500s and 429s (with a Retry-After header).
+    """
+    def __init__(self, time_to_first_token=0.3, tokens_per_second=50., error_rate=0., rate_limit_rate=0., retry_after=1., seed=None):
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self.requests = 0
+
+    @classmethod
+    def from_env(cls):
+        seed = os.getenv("AGENT_LAB_FAKE_LLM_SEED")
+        return cls(
+            time_to_first_token=float(os.getenv("AGENT_LAB_FAKE_LLM_TTFT", "0.3")),
+            tokens_per_second=float(os.getenv("AGENT_LAB_FAKE_LLM_TPS", "50")),
+            error_rate=float(os.getenv("AGENT_LAB_FAKE_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("AGENT_LAB_FAKE_LLM_RATE_LIMIT_RATE", "0")),
+            seed=int(seed) if seed is not None else None,
+        )
+
+    def _error(self, status_code, message, headers=None):
+        body = {"error": {"message": message, "type": "fake_error", "param": None, "code": None}}
+        return httpx.Response(status_code, headers=headers, json=body)
+
+    def _reply_text(self, messages):
+        sentences = self._random.sample(sample_sentences, k=self._random.randint(2, 4))
+        system_prompt = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+        if "json list" in system_prompt.lower():
+            return json.dumps(sentences)
+        return " ".join(sentences)
+
+    def _example(self, schema, name="value"):
+        """A value that validates against a (dereferenced) json schema."""
+        if "allOf" in schema:
+            merged = {}
+            for sub_schema in schema["allOf"]:
+                merged.update(sub_schema)
+            merged.update({key: value for key, value in schema.items() if key != "allOf"})
+            return self._example(merged, name)
+        if "enum" in schema:
+            return schema["enum"][0]
+        if "anyOf" in schema or "oneOf" in schema:
+            return self._example((schema.get("anyOf") or schema.get("oneOf"))[0], name)
+        schema_type = schema.get("type")
+        if schema_type == "object" or "properties" in schema:
+            return {key: self._example(value, key) for key, value in schema.get("properties", {}).items()}
+        if schema_type == "array":
+            n_items = max(schema.get("minItems", 3), 3)
+            return [self._example(schema.get("items", {"type": "string"}), f"{name} {i + 1}") for i in range(n_items)]
+        if schema_type == "integer":
+            return 0
+        if schema_type == "number":
+            return round(self._random.uniform(0.1, 1.0), 2)
+        if schema_type == "boolean":
+            return True
+        return f"{name}: {self._random.choice(sample_sentences)}"
+
+    def _tool_call(self, body):
+        tools = body["tools"]
+        tool_choice = body.get("tool_choice")
+        tool = tools[0]
+        if isinstance(tool_choice, dict):
+            tool = next(t for t in tools if t["function"]["name"] == tool_choice["function"]["name"])
+        arguments = self._example(tool["function"]["parameters"])
+        return {
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {"name": tool["function"]["name"], "arguments": json.dumps(arguments)},
+        }
+
+    def _tokens(self, text):
+        words = text.split(" ")
+        return [word + " " for word in words[:-1]] + [words[-1]]
+
+    async def _stream(self, completion_id, model, text):
+        await asyncio.sleep(self.time_to_first_token)
+        for i, token in enumerate(self._tokens(text)):
+            if i > 0 and self.tokens_per_second > 0:
+                await asyncio.sleep(1. / self.tokens_per_second)
+            delta = {"content": token} if i > 0 else {"role": "assistant", "content": token}
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+        yield b"data: [DONE]\n\n"
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+            return self._error(404, f"{request.method} {request.url.path} is not supported by the fake backend")
+        body = json.loads(await request.aread())
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return self._error(429, "Rate limit reached (injected).", headers={"retry-after": str(self.retry_after)})
+        if roll < self.rate_limit_rate + self.error_rate:
+            return self._error(500, "The server had an error (injected).")
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "fake")
+        if body.get("stream"):
+            text = self._reply_text(body.get("messages", []))
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=FakeByteStream(self._stream(completion_id, model, text)))
+
+        if body.get("tools"):
+            message = {"role": "assistant", "content": None, "tool_calls": [self._tool_call(body)]}
+            n_tokens = len(message["tool_calls"][0]["function"]["arguments"]) // 4
+            finish_reason = "tool_calls"
+        else:
+            message = {"role": "assistant", "content": self._reply_text(body.get("messages", []))}
+            n_tokens = len(self._tokens(message["content"]))
+            finish_reason = "stop"
+        delay = self.time_to_first_token + (n_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": n_tokens, "total_tokens": n_tokens},
+        })
@@ -1,7 +1,7 @@
 import asyncio
-from pydantic import ConfigDict, BaseModel, Field
+from pydantic import ConfigDict, BaseModel, Field, PrivateAttr
 from typing import List, Dict
-from active_inference_service import ActiveInferenceService, Policy, PolicyIsCompleteEnum, select_policy_fn
+from active_inference_service import ActiveInferenceService, Policy, PolicyIsCompleteEnum, PromptPrefixStats, select_policy_fn
 
 # from eval_service import EvalService, Action
 from generative_model import GenerativeModel, GenerativeModelFactory
@@ -20,6 +20,8 @@ class MetaAgent(BaseModel):
     # actions: List[Action] = Field(..., description="List of actions the assistant can take")
     # s_u_c: (float, float, float) = Field(..., description="Score, utility, confidence")
     current_policy: Policy = Field(None, description="Current policy")
+    # kept across steps, each step uses a new ActiveInferenceService
+    _prefix_stats: PromptPrefixStats = PrivateAttr(default_factory=PromptPrefixStats)
 
     def __init__(self, **data):
         if 'state' not in data:
@@ -44,59 +46,80 @@ class MetaAgent(BaseModel):
         # for line in pritty_sensor_stream.split("\n"):
         #     self.debug_strings.append(f" - {line}")
 
-        active_inference_service = ActiveInferenceService()
-
-        if self.current_policy is not None:
-            self.debug_strings.append(f"--- current policy ---")
-            self.debug_strings.append(f"- {self.current_policy.policy}")
-            self.debug_strings.append(f"--- updating model...")
-
-            model_task = asyncio.create_task(active_inference_service.update_generative_model(sensor_stream, self.generative_model, self.current_policy))
-            policy_task = asyncio.create_task(active_inference_service.track_policy_progress(sensor_stream, self.generative_model, self.current_policy))
-            model_update, policy_update = await asyncio.gather(model_task, policy_task)
-
-            self.debug_strings.append(f"--- generative_model changes ---")
-            old_generatilve_model = self.generative_model
-            self.generative_model = model_update.generative_model
-            if (len(self.generative_model.assistant_beliefs- old_generatilve_model.assistant_beliefs)):
-                self.debug_strings.append (f"-- assistant_beliefs")
-                for item in self.generative_model.assistant_beliefs- old_generatilve_model.assistant_beliefs:
-                    self.debug_strings.append (f" - {item}")
-            if (len(self.generative_model.assistant_desires- old_generatilve_model.assistant_desires)):
-                self.debug_strings.append (f"-- assistant_desires")
-                for item in self.generative_model.assistant_desires- old_generatilve_model.assistant_desires:
-                    self.debug_strings.append (f" - {item}")
-            if (len(self.generative_model.uncertainty_in_the_system- old_generatilve_model.uncertainty_in_the_system)):
-                self.debug_strings.append (f"-- uncertainty_in_the_system")
-                for item in self.generative_model.uncertainty_in_the_system- old_generatilve_model.uncertainty_in_the_system:
-                    self.debug_strings.append (f" - {item}")
-
-            # self.debug_strings.append(f" policy_progress: {policy_update.policy_progress}")
-            self.debug_strings.append(f" progress: {policy_update.question_1}")
-            self.debug_strings.append(f" outcome achieved?: {policy_update.question_2}")
-            self.debug_strings.append(f" still likley?: {policy_update.question_3}")
-            self.debug_strings.append(f" - {policy_update.policy_is_complete.name}")
-
-            if policy_update.policy_is_complete == PolicyIsCompleteEnum.complete or \
-                    policy_update.policy_is_complete == PolicyIsCompleteEnum.interrupt_policy:
-                self.current_policy = None
-
-        if self.current_policy is None:
-            self.debug_strings.append(f"--- selecting new policy...")
-            select_policies_result:select_policy_fn = await active_inference_service.select_policy(sensor_stream, self.generative_model)
-            self.current_policy = select_policies_result.policies[select_policies_result.selected_policy_idx]
-            self.debug_strings.append(f"-- selected policy -")
-            self.debug_strings.append(f"- {self.current_policy.policy}")
-            # self.debug_strings.append(f"-- free energy causes -")
-            # for free_energy in select_policies_result.free_energy_causes:
-            #     self.debug_strings.append(f"- {free_energy.cause} ({free_energy.estimated_free_energy})")
-            self.debug_strings.append(f"-- policies -")
-            for policy in select_policies_result.policies:
-                self.debug_strings.append(f"- policy: {policy.policy}")
-                self.debug_strings.append(f"  expected_outcome: {policy.expected_outcome}")
-                self.debug_strings.append(f"  estimated_free_energy_reduction: {policy.estimated_free_energy_reduction}")
-                self.debug_strings.append(f"  probability_of_success: {policy.probability_of_success}")
-                self.debug_strings.append(f" {policy.estimated_free_energy_reduction * policy.probability_of_success}")
+        active_inference_service = ActiveInferenceService(prefix_stats=self._prefix_stats)
+        compact_task = None
+        # stable prompts keep the evicted events in view, compacting them in chunks rewrites the summary (and breaks the cached prefix) less often
+        min_evicted = max(sensor_stream.capacity // 4, 1) if active_inference_service.stable_prompts else 1
+        if len(sensor_stream.evicted) >= min_evicted:
+            # runs alongside the steps below, they render the stream as it is now
+            compact_task = asyncio.create_task(sensor_stream.compact_async(active_inference_service.summarize_stream))
+
+        step_done = False
+        try:
+            if self.current_policy is not None:
+                self.debug_strings.append(f"--- current policy ---")
+                self.debug_strings.append(f"- {self.current_policy.policy}")
+                self.debug_strings.append(f"--- updating model...")
+
+                model_task = asyncio.create_task(active_inference_service.update_generative_model(sensor_stream, self.generative_model, self.current_policy))
+                policy_task = asyncio.create_task(active_inference_service.track_policy_progress(sensor_stream, self.generative_model, self.current_policy))
+                model_update, policy_update = await asyncio.gather(model_task, policy_task)
+
+                self.debug_strings.append(f"--- generative_model changes ---")
+                old_generatilve_model = self.generative_model
+                self.generative_model = model_update.generative_model
+                if (len(self.generative_model.assistant_beliefs- old_generatilve_model.assistant_beliefs)):
+                    self.debug_strings.append (f"-- assistant_beliefs")
+                    for item in self.generative_model.assistant_beliefs- old_generatilve_model.assistant_beliefs:
+                        self.debug_strings.append (f" - {item}")
+                if (len(self.generative_model.assistant_desires- old_generatilve_model.assistant_desires)):
+                    self.debug_strings.append (f"-- assistant_desires")
+                    for item in self.generative_model.assistant_desires- old_generatilve_model.assistant_desires:
+                        self.debug_strings.append (f" - {item}")
+                if (len(self.generative_model.uncertainty_in_the_system- old_generatilve_model.uncertainty_in_the_system)):
+                    self.debug_strings.append (f"-- uncertainty_in_the_system")
+                    for item in self.generative_model.uncertainty_in_the_system- old_generatilve_model.uncertainty_in_the_system:
+                        self.debug_strings.append (f" - {item}")
+
+                # self.debug_strings.append(f" policy_progress: {policy_update.policy_progress}")
+                self.debug_strings.append(f" progress: {policy_update.question_1}")
+                self.debug_strings.append(f" outcome achieved?: {policy_update.question_2}")
+                self.debug_strings.append(f" still likley?: {policy_update.question_3}")
+                self.debug_strings.append(f" - {policy_update.policy_is_complete.name}")
+
+                if policy_update.policy_is_complete == PolicyIsCompleteEnum.complete or \
+                        policy_update.policy_is_complete == PolicyIsCompleteEnum.interrupt_policy:
+                    self.current_policy = None
+
+            if self.current_policy is None:
+                self.debug_strings.append(f"--- selecting new policy...")
+                select_policies_result:select_policy_fn = await active_inference_service.select_policy(sensor_stream, self.generative_model)
+                self.current_policy = select_policies_result.policies[select_policies_result.selected_policy_idx]
+                self.debug_strings.append(f"-- selected policy -")
+                self.debug_strings.append(f"- {self.current_policy.policy}")
+                # self.debug_strings.append(f"-- free energy causes -")
+                # for free_energy in select_policies_result.free_energy_causes:
+                #     self.debug_strings.append(f"- {free_energy.cause} ({free_energy.estimated_free_energy})")
+                self.debug_strings.append(f"-- policies -")
+                for policy in select_policies_result.policies:
+                    self.debug_strings.append(f"- policy: {policy.policy}")
+                    self.debug_strings.append(f"  expected_outcome: {policy.expected_outcome}")
+                    self.debug_strings.append(f"  estimated_free_energy_reduction: {policy.estimated_free_energy_reduction}")
+                    self.debug_strings.append(f"  probability_of_success: {policy.probability_of_success}")
+                    self.debug_strings.append(f" {policy.estimated_free_energy_reduction * policy.probability_of_success}")
+            step_done = True
+        finally:
+            if compact_task is not None:
+                if not step_done:
+                    # the step failed or was cancelled, don't leave the summary call running on its own
+                    compact_task.cancel()
+                compact_result, = await asyncio.gather(compact_task, return_exceptions=True)
+                if isinstance(compact_result, Exception):
+                    # the evicted events stay queued, we try again next step
+                    print(f"Exception compacting sensory stream: {compact_result}")
+        self.debug_strings.append(f"--- sensory stream: {len(sensor_stream)} events, {sensor_stream.summarized_events} summarized, {len(sensor_stream.evicted)} waiting ---")
+        mode = "stable" if active_inference_service.stable_prompts else "default"
+        self.debug_strings.append(f"--- prompt prefix reuse ({mode} prompts): {self._prefix_stats.hit_ratio:.0%} ---")
 
         
 
@@ -1,9 +1,28 @@
+import os
+from token_counter import count_message_tokens, count_tokens
 
 
 class PromptManager:
-    def __init__(self):
+    """The chat messages sent to ChatService, kept within a token budget.
+
+    Token counts are tracked per message and updated as messages change; appending to a
+    message only counts the appended text. When the total goes over max_prompt_tokens
+    (AGENT_LAB_PROMPT_TOKEN_BUDGET) the oldest turns are dropped, but never the system
+    prompt or the newest message. Dropped turns wait in `trimmed` until compact_async folds
+    them into conversation_summary, which the system prompt carries in their place.
+    """
+    def __init__(self, max_prompt_tokens=None, model_id="gpt-3.5-turbo", summary_max_chars=2000):
         self.policy = "respond to the user's questions and statements"
         self.expected_outcome = "form a friendship with the user"
+        self.max_prompt_tokens = max_prompt_tokens if max_prompt_tokens is not None else int(os.getenv("AGENT_LAB_PROMPT_TOKEN_BUDGET", "3000"))
+        self.model_id = model_id
+        self.conversation_summary = ""
+        self.summary_max_chars = summary_max_chars
+        self.trimmed_messages = 0
+        self.trimmed = []
+        self.summarized_messages = 0
+        # trimmed turns that were never summarized because compaction fell too far behind
+        self.dropped_messages = 0
         
         self.reset()
 
@@ -64,27 +83,85 @@ I fell off the pink step, and I had an accident.
             return
         for i, message in enumerate(self.messages):
             if message["role"] == "system":
-                self.messages[i]["content"] = self._build_system_prompt(self.policy, self.expected_outcome)
+                content = self._build_system_prompt(self.policy, self.expected_outcome)
+                if len(self.conversation_summary):
+                    content += f"\n---\nEarlier in the conversation: {self.conversation_summary}\n"
+                self.messages[i]["content"] = content
+                self._recount(i)
                 return
 
+    def _recount(self, i):
+        self.token_counts[i] = count_message_tokens(self.messages[i], self.model_id)
+
+    def _append(self, message):
+        self.messages.append(message)
+        self.token_counts.append(count_message_tokens(message, self.model_id))
+        self._fit_budget()
+
+    def _extend_last(self, text):
+        self.messages[-1]["content"] += text
+        # counting just the new text can be one token off at the join, which errs towards trimming
+        self.token_counts[-1] += count_tokens(text, self.model_id)
+        self._fit_budget()
+
+    @property
+    def total_tokens(self):
+        return sum(self.token_counts)
+
+    def _fit_budget(self):
+        # messages[0] is the system prompt, the last message is what we are responding to
+        while len(self.messages) > 2 and self.total_tokens > self.max_prompt_tokens:
+            self.trimmed.append(self.messages.pop(1))
+            del self.token_counts[1]
+            self.trimmed_messages += 1
+        self._bound_trimmed()
+
+    def _bound_trimmed(self, max_waiting=100):
+        overflow = len(self.trimmed) - max_waiting
+        if overflow > 0:
+            del self.trimmed[:overflow]
+            self.dropped_messages += overflow
+
+    async def compact_async(self, summarize_fn):
+        """Folds the trimmed turns into conversation_summary with `await summarize_fn(summary, lines)`,
+        which returns the new summary (e.g. ActiveInferenceService.summarize_conversation)."""
+        if len(self.trimmed) == 0:
+            return
+        messages = self.trimmed
+        self.trimmed = []
+        lines = [f"{message['role'].capitalize()}: {message['content']}" for message in messages]
+        try:
+            summary = await summarize_fn(self.conversation_summary, lines)
+        except BaseException:
+            # try again next time
+            self.trimmed = messages + self.trimmed
+            self._bound_trimmed()
+            raise
+        self.summarized_messages += len(messages)
+        self.set_conversation_summary(summary[:self.summary_max_chars])
 
     def reset(self):
         self.messages = []
+        self.token_counts = []
         self.messages.append({"role": "system", "content": self._build_system_prompt(self.policy, self.expected_outcome)})
+        self.token_counts.append(0)
         self._add_policy_to_system_prompt()
+        self._recount(0)
         self.force_next_new_message = False
 
     def append_user_message(self, message):
         if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
-            self.messages[-1]["content"] += message
+            self._extend_last(message)
         else:
-            self.messages.append({"role": "user", "content": message})
+            self._append({"role": "user", "content": message})
 
     def replace_or_append_user_message(self, message):
         if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
             self.messages[-1]["content"] = message
+            self._recount(len(self.messages) - 1)
+            self._fit_budget()
         else:
-            self.messages.append({"role": "user", "content": message})
+            self._append({"role": "user", "content": message})
 
     def append_assistant_message(self, message, force_new_message=False):
         # check if last message was from assistant, if so append to that message
@@ -92,16 +169,24 @@ I fell off the pink step, and I had an accident.
                 and self.messages[-1]["role"] == "assistant" \
                 and not self.force_next_new_message \
                 and not force_new_message:
-            self.messages[-1]["content"] += message
+            self._extend_last(message)
             self.force_next_new_message = False
         else:
-            self.messages.append({"role": "assistant", "content": message})
+            self._append({"role": "assistant", "content": message})
             self.force_next_new_message = force_new_message
 
     def set_policy(self, policy, expected_outcome):
         self.policy = policy
         self.expected_outcome = expected_outcome
         self._add_policy_to_system_prompt()
+        self._fit_budget()
+
+    def set_conversation_summary(self, summary):
+        if summary == self.conversation_summary:
+            return
+        self.conversation_summary = summary
+        self._add_policy_to_system_prompt()
+        self._fit_budget()
 
     def get_messages(self):
         return self.messages
\ No newline at end of file
@@ -1,55 +1,141 @@
 
 from asyncio import Queue, TaskGroup
 import asyncio
+from contextlib import aclosing
+import os
 import time
 from agent_response import AgentResponse
 from chat_service import ChatService
 from response_state_manager import ResponseStateManager
 
 
+class PreviewInterval:
+    """How long the pacer waits between preview updates.
+
+    AGENT_LAB_PREVIEW_INTERVAL is a number of seconds, or "adaptive" to follow the rate
+    chunks arrive at (an exponential moving average of the gap between them), clamped
+    between min_seconds and max_seconds.
+    """
+    def __init__(self, fixed_seconds=None, min_seconds=1/30, max_seconds=1/4, smoothing=0.2):
+        self.fixed_seconds = fixed_seconds
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.smoothing = smoothing
+        self.average_gap = None
+        self._last_chunk_time = None
+
+    @classmethod
+    def from_env(cls):
+        setting = os.getenv("AGENT_LAB_PREVIEW_INTERVAL", str(1/7))
+        if setting == "adaptive":
+            return cls()
+        return cls(fixed_seconds=float(setting))
+
+    def on_chunk(self):
+        now = time.monotonic()
+        if self._last_chunk_time is not None:
+            gap = now - self._last_chunk_time
+            if self.average_gap is None:
+                self.average_gap = gap
+            else:
+                self.average_gap += self.smoothing * (gap - self.average_gap)
+        self._last_chunk_time = now
+
+    def seconds(self):
+        if self.fixed_seconds is not None:
+            return self.fixed_seconds
+        if self.average_gap is None:
+            return self.min_seconds
+        return min(max(self.average_gap, self.min_seconds), self.max_seconds)
+
+
 class RespondToPromptAsync:
     def __init__(self, response_state_manager:ResponseStateManager):
         self.response_state_manager = response_state_manager
+        # once set nothing more is published, the response has been superseded
+        self.cancel_event = asyncio.Event()
+        self.task_group_tasks = []
 
     async def prompt_to_llm(self, prompt:str, messages:[str]):
+        """A reader drains the LLM stream as fast as it arrives, a pacer publishes previews.
+
+        Complete sentences are published by the reader as soon as they arrive. Previews go
+        into a one slot buffer (newer replace older) that the pacer publishes at most once per
+        preview interval, so the UI is never flooded and the HTTP read is never slowed down.
+        """
         chat_service = ChatService()
-        self.speed_limit = None
-        self.speed_limit = 1/7.
-        self.last_time = time.time()
+        agent_response = AgentResponse(prompt)
+        preview_interval = PreviewInterval.from_env()
+        preview_ready = asyncio.Event()
+        latest_preview = None
+        reader_done = False
 
-        async def respect_speed_limit():
-            if self.speed_limit is not None and self.speed_limit > 0:
-                to_wait = self.speed_limit - (time.time() - self.last_time)
-                if to_wait > 0:
-                    await asyncio.sleep(to_wait)
-            self.last_time = time.time()
+        async def reader():
+            nonlocal latest_preview, reader_done
+            sentences = chat_service.get_responses_as_sentances_async(messages, cancel_event=self.cancel_event)
+            try:
+                async with aclosing(sentences):
+                    async for text, is_complete_sentance in sentences:
+                        if self.cancel_event.is_set():
+                            return
+                        preview_interval.on_chunk()
+                        if is_complete_sentance and chat_service.ignore_sentence(text):
+                            is_complete_sentance = False
+                        if not is_complete_sentance:
+                            latest_preview = text
+                            preview_ready.set()
+                            continue
+                        # the sentence supersedes any preview still waiting for the pacer
+                        latest_preview = None
+                        agent_response['llm_preview'] = ''
+                        agent_response['llm_sentence'] = text
+                        agent_response['llm_sentences'].append(text)
+                        self.response_state_manager.add_llm_response_and_clear_llm_preview(text)
+                        print(f"{agent_response['llm_sentence']} id: {agent_response['llm_sentence_id']} from prompt: {agent_response['prompt']}")
+                        sentence_response = agent_response.make_copy()
+                        # TODO add any chains on sentence here
+                        agent_response['llm_sentence_id'] += 1
+            finally:
+                reader_done = True
+                preview_ready.set()
+
+        async def pacer():
+            nonlocal latest_preview
+            while True:
+                await preview_ready.wait()
+                preview_ready.clear()
+                if self.cancel_event.is_set():
+                    return
+                if latest_preview is not None:
+                    agent_response['llm_preview'] = latest_preview
+                    self.response_state_manager.set_llm_preview(latest_preview)
+                    latest_preview = None
+                if reader_done:
+                    return
+                await asyncio.sleep(preview_interval.seconds())
 
         async with TaskGroup() as tg:
-            agent_response = AgentResponse(prompt)
-            async for text, is_complete_sentance in chat_service.get_responses_as_sentances_async(messages):
-                await respect_speed_limit()
-                if chat_service.ignore_sentence(text):
-                    is_complete_sentance = False
-                if not is_complete_sentance:
-                    agent_response['llm_preview'] = text
-                    self.response_state_manager.set_llm_preview(text)
-                    continue
-                agent_response['llm_preview'] = ''
-                agent_response['llm_sentence'] = text
-                agent_response['llm_sentences'].append(text)
-                self.response_state_manager.add_llm_response_and_clear_llm_preview(text)
-                print(f"{agent_response['llm_sentence']} id: {agent_response['llm_sentence_id']} from prompt: {agent_response['prompt']}")
-                sentence_response = agent_response.make_copy()
-                # TODO add any chains on sentence here
-                agent_response['llm_sentence_id'] += 1    
+            tg.create_task(reader())
+            tg.create_task(pacer())
 
     async def run(self, prompt:str, messages:[str]):
         self.task_group_tasks = []
-        async with TaskGroup() as tg:  # Use asyncio's built-in TaskGroup
-            t1 = tg.create_task(self.prompt_to_llm(prompt, messages))
-            self.task_group_tasks.extend([t1])
+        try:
+            async with TaskGroup() as tg:  # Use asyncio's built-in TaskGroup
+                t1 = tg.create_task(self.prompt_to_llm(prompt, messages))
+                self.task_group_tasks.extend([t1])
+        finally:
+            # the task status is part of the rendered state, so wake the UI loop when we finish
+            self.response_state_manager.notify_changed()
+
+    def cancel(self):
+        """Stops publishing immediately, the tasks finish (and close the LLM stream) shortly after."""
+        self.cancel_event.set()
+        for task in self.task_group_tasks:
+            task.cancel()
 
     async def terminate(self):
+        self.cancel_event.set()
         # Cancel tasks
         all_tasks = []
         if self.task_group_tasks:
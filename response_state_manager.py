@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime
 
 class ResponseStepObservations:
@@ -34,13 +35,26 @@ class ResponseStateManager:
         self.response_step_obs = None
         self.response_state = None
         self.show_packets = False
+        # set whenever anything the UI renders changes; consumers wait on it instead of polling
+        self.changed = asyncio.Event()
         self.reset_episode()
 
+    def notify_changed(self):
+        self.changed.set()
+
+    async def wait_for_change(self, coalesce_window=0.):
+        await self.changed.wait()
+        # hold the window open so a burst of changes is handled as one update
+        if coalesce_window > 0:
+            await asyncio.sleep(coalesce_window)
+        self.changed.clear()
+
     def reset_episode(self)->(ResponseStepObservations, ResponseState):
         self.episode += 1
         self.step = 0
         self.response_state = ResponseState(self.episode, self.step)
         self.response_step_obs = ResponseStepObservations(self.episode, self.step)
+        self.notify_changed()
         return self.response_step_obs, self.response_state
 
     def begin_next_step(self)->(ResponseStepObservations, ResponseState):
@@ -52,6 +66,7 @@ class ResponseStateManager:
     def set_llm_preview(self, llm_preview):
         self.response_step_obs.llm_preview = llm_preview
         self.response_state.llm_preview = llm_preview
+        self.notify_changed()
 
     def add_llm_response_and_clear_llm_preview(self, llm_response):
         self.response_state.current_responses.append(llm_response)
@@ -59,10 +74,12 @@ class ResponseStateManager:
         self.response_step_obs.llm_responses.append(llm_response)
         self.response_step_obs.llm_preview = ''
         self.response_state.llm_preview = ''
+        self.notify_changed()
 
     def add_tts_raw_chunk_id(self, chunk_id, llm_sentence_id):
         self.response_state.speech_chunks_per_response[llm_sentence_id] += 1
         self.response_step_obs.tts_raw_chunk_ids.append(chunk_id)
+        self.notify_changed()
 
     def pretty_print_current_responses(self)->str:
         line = ""
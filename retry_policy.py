@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import random
+import time
+import openai
+import pydantic
+
+
+class InvalidResponseError(Exception):
+    """The provider answered, but not with something we can use (no tool call, bad json, ...)."""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fails fast while the provider looks down.
+
+    failure_threshold consecutive transport failures open the circuit. After reset_timeout
+    seconds it goes half open and lets a single probe call through, everyone else is still
+    refused; the probe's success closes the circuit, its failure opens it for another
+    reset_timeout. A probe that is abandoned (e.g. cancelled) should call release_probe so
+    the next caller probes straight away; one that never reports back at all is given up on
+    after reset_timeout.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.open_until = None
+        self.probe_started_at = None
+        self.times_opened = 0
+        self.fast_failures = 0
+
+    def _refuse(self, reason):
+        self.fast_failures += 1
+        raise CircuitOpenError(reason)
+
+    def before_call(self):
+        now = time.monotonic()
+        if self.state == "open":
+            if now < self.open_until:
+                self._refuse(f"LLM provider circuit is open after {self.consecutive_failures} consecutive failures, retrying in {self.open_until - now:.1f} seconds.")
+            self.state = "half_open"
+            self.probe_started_at = None
+        if self.state == "half_open":
+            if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout:
+                self._refuse("LLM provider circuit is half open and a probe call is in flight.")
+            self.probe_started_at = now
+            return now
+        return None
+
+    def release_probe(self, probe):
+        """Lets another caller probe, for a probe (as returned by before_call) that ends without an outcome."""
+        if probe is not None and self.state == "half_open" and self.probe_started_at == probe:
+            self.probe_started_at = None
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probe_started_at = None
+
+    def open_for(self, seconds:float):
+        """Opens the circuit for at least seconds, e.g. for a Retry-After we won't wait out."""
+        open_until = time.monotonic() + seconds
+        if self.state == "open":
+            open_until = max(open_until, self.open_until)
+        else:
+            self.times_opened += 1
+        self.state = "open"
+        self.open_until = open_until
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.open_for(self.reset_timeout)
+
+
+class RetryPolicy:
+    """Bounded retries with capped exponential backoff and full jitter.
+
+    Errors are classified as:
+     - "rate_limit": 429, waits for Retry-After when the provider sends one; a Retry-After
+       longer than max_delay is not waited out, we give up and open the circuit for that long
+     - "transport": connection errors, timeouts and 5xx, these also count against the circuit breaker
+     - "validation": the response did not parse or validate, retried at most max_validation_attempts times
+     - "fatal": anything else (auth, bad request, our own bugs), raised straight away
+    """
+    def __init__(self, max_attempts=5, base_delay=0.1, max_delay=10., max_validation_attempts=3, circuit_breaker:CircuitBreaker = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_validation_attempts = max_validation_attempts
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        self.calls = 0
+        self.retries = {"rate_limit": 0, "transport": 0, "validation": 0}
+        self.gave_up = 0
+
+    def classify(self, error:Exception) -> str:
+        if isinstance(error, openai.RateLimitError):
+            return "rate_limit"
+        if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+            return "transport"
+        if isinstance(error, openai.APIStatusError):
+            return "transport" if error.status_code >= 500 else "fatal"
+        if isinstance(error, (InvalidResponseError, pydantic.ValidationError, json.JSONDecodeError)):
+            return "validation"
+        return "fatal"
+
+    def _retry_after(self, error:Exception):
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt:int, error:Exception = None) -> float:
+        retry_after = self._retry_after(error) if isinstance(error, openai.RateLimitError) else None
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def before_attempt(self, attempt:int):
+        """Returns the circuit breaker probe this attempt holds (None unless half open), see on_abandon."""
+        if attempt == 1:
+            self.calls += 1
+        return self.circuit_breaker.before_call()
+
+    def on_success(self):
+        self.circuit_breaker.record_success()
+
+    def on_abandon(self, probe):
+        """Records an attempt that ended with neither success nor error, e.g. it was cancelled."""
+        self.circuit_breaker.release_probe(probe)
+
+    def on_error(self, error:Exception, attempt:int, retryable=True) -> float:
+        """Records a failed attempt. Returns how long to wait before the next one, or re-raises if we should stop."""
+        kind = self.classify(error)
+        if kind == "transport":
+            self.circuit_breaker.record_failure()
+        else:
+            # the provider did answer, so it is up
+            self.circuit_breaker.record_success()
+        limit = self.max_validation_attempts if kind == "validation" else self.max_attempts
+        if kind == "fatal" or not retryable or attempt >= limit:
+            self.gave_up += 1
+            raise error
+        delay = self.backoff(attempt, error)
+        if delay > self.max_delay:
+            # only a Retry-After can be this long, every caller would hit the same limit
+            self.circuit_breaker.open_for(delay)
+            self.gave_up += 1
+            raise error
+        self.retries[kind] += 1
+        return delay
+
+    async def call(self, fn):
+        """Returns `await fn()`, retrying according to the policy."""
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = self.before_attempt(attempt)
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                self.on_abandon(probe)
+                raise
+            except Exception as e:
+                delay = self.on_error(e, attempt)
+                print(f"LLM call failed ({self.classify(e)}, attempt {attempt}/{self.max_attempts}): {e}")
+                print(f"Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+                continue
+            self.on_success()
+            return result
+
+    def metrics(self):
+        return {
+            "calls": self.calls,
+            "retries": dict(self.retries),
+            "gave_up": self.gave_up,
+            "circuit_state": self.circuit_breaker.state,
+            "circuit_opened": self.circuit_breaker.times_opened,
+            "circuit_fast_failures": self.circuit_breaker.fast_failures,
+        }
+
+
+_default_retry_policy = None
+
+def default_retry_policy() -> RetryPolicy:
+    """Process wide policy (and circuit breaker) shared by every LLM caller, configured by AGENT_LAB_LLM_* environment variables."""
+    global _default_retry_policy
+    if _default_retry_policy is None:
+        _default_retry_policy = RetryPolicy(
+            max_attempts=int(os.getenv("AGENT_LAB_LLM_MAX_ATTEMPTS", "5")),
+            base_delay=float(os.getenv("AGENT_LAB_LLM_RETRY_BASE_DELAY", "0.1")),
+            max_delay=float(os.getenv("AGENT_LAB_LLM_RETRY_MAX_DELAY", "10")),
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("AGENT_LAB_LLM_BREAKER_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("AGENT_LAB_LLM_BREAKER_RESET", "30")),
+            ),
+        )
+    return _default_retry_policy
@@ -1,33 +1,169 @@
 
 import datetime
+import itertools
+import os
 import time
-from dateutil import parser
+from array import array
+import bisect
+
+
+def iso_time_stamp(time_stamp:float) -> str:
+    """UTC ISO 8601 for an epoch time stamp, for logs and anything else outside the process."""
+    return datetime.datetime.fromtimestamp(time_stamp, datetime.timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def pretty_print_time_since(time_stamp:float, now:float=None) -> str:
+    time_since = (time.time() if now is None else now) - time_stamp
+    if time_since < 1:
+        return "just now"
+    if time_since < 60:
+        return f"{int(time_since)} seconds ago"
+    elif time_since < 3600:
+        return f"{int(time_since / 60)} minutes ago"
+    elif time_since < 86400:
+        return f"{int(time_since / 3600)} hours ago"
+    else:
+        return f"{int(time_since / 86400)} days ago"
+
 
 class StreamEvent:
+    __slots__ = ("event", "time_stamp")
     event: str
-    time_stamp: str
+    time_stamp: float
     def __init__(self, event, time_stamp):
         self.event = event
         self.time_stamp = time_stamp
 
+    @property
+    def iso_time_stamp(self) -> str:
+        return iso_time_stamp(self.time_stamp)
+
 class SensoryStream:
-    def __init__(self):
-        self.events:[StreamEvent] = []
+    """Perception history, oldest first.
+
+    Time stamps are epoch seconds (time.time()) kept in an array("d") alongside a list of
+    the event texts, and never go backwards even if the wall clock does, so the stream is
+    always sorted by time. Convert with iso_time_stamp only when leaving the process.
+
+    Only the newest `capacity` events (AGENT_LAB_SENSORY_STREAM_CAPACITY) are kept, in a
+    ring buffer. Older ones move to `evicted` until compact_async folds them into `summary`,
+    which the renders show in their place, so a prompt built from the stream stays the
+    same size however long the session runs.
+
+    With an event_log (event_log.EventLogWriter) every appended event is also written to disk.
+    If the log fails the stream carries on in memory, the error is kept in event_log_error.
+    """
+    def __init__(self, capacity=None, summary_max_chars=2000, event_log=None):
+        self.capacity = capacity if capacity is not None else int(os.getenv("AGENT_LAB_SENSORY_STREAM_CAPACITY", "100"))
+        assert self.capacity > 0, "capacity must be positive"
+        self.summary_max_chars = summary_max_chars
+        self.event_log = event_log
+        self.event_log_error = None
+        self._event_texts:[str] = [None] * self.capacity
+        self._time_stamps = array("d", bytes(8 * self.capacity))
+        self._start = 0
+        self._count = 0
+        self.evicted:[StreamEvent] = []
+        self.summary = ""
+        # time stamp of the newest event the summary covers
+        self.summary_until = None
+        self.summarized_events = 0
+        # evicted events that were never summarized because compaction fell too far behind
+        self.dropped_events = 0
+
+    def __len__(self):
+        return self._count
+
+    def _index(self, i):
+        return (self._start + i) % self.capacity
+
+    def _iter_range(self, lo=0, hi=None):
+        """(event, time_stamp) pairs for the lo..hi oldest to newest events, at most two slices of the ring."""
+        hi = self._count if hi is None else min(hi, self._count)
+        start = self._index(lo)
+        end = start + max(hi - lo, 0)
+        if end <= self.capacity:
+            return zip(self._event_texts[start:end], self._time_stamps[start:end])
+        end -= self.capacity
+        return itertools.chain(
+            zip(self._event_texts[start:], self._time_stamps[start:]),
+            zip(self._event_texts[:end], self._time_stamps[:end]))
 
-    def _time_stamp(self):
-        utc_time = datetime.datetime.utcnow()
-        return utc_time.isoformat()
+    @property
+    def events(self) -> [StreamEvent]:
+        return [StreamEvent(event, time_stamp) for event, time_stamp in self._iter_range()]
 
-    def _time_since(self, time_stamp):
-        current_utc_time = datetime.datetime.utcnow()
-        past_time = parser.parse(time_stamp)
-        time_difference = current_utc_time - past_time
-        return time_difference.total_seconds()
+    def _time_stamp(self, time_stamp:float=None):
+        time_stamp = time.time() if time_stamp is None else time_stamp
+        if self._count:
+            time_stamp = max(time_stamp, self._time_stamps[self._index(self._count - 1)])
+        return time_stamp
 
-    def append_event(self, event):
-        now = self._time_stamp()
-        stream_event = StreamEvent(event=event, time_stamp=now)
-        self.events.append(stream_event)
+    def _time_since(self, time_stamp:float):
+        return time.time() - time_stamp
+
+    def _evict_oldest(self):
+        self.evicted.append(StreamEvent(self._event_texts[self._start], self._time_stamps[self._start]))
+        self._event_texts[self._start] = None
+        self._start = self._index(1)
+        self._count -= 1
+        self._trim_evicted()
+
+    def _trim_evicted(self):
+        # at most capacity events wait for compaction, the oldest go first
+        overflow = len(self.evicted) - self.capacity
+        if overflow > 0:
+            del self.evicted[:overflow]
+            self.dropped_events += overflow
+
+    def append_event(self, event, time_stamp:float=None):
+        """time_stamp defaults to now, pass one to rebuild a stream from a record of it."""
+        time_stamp = self._time_stamp(time_stamp)
+        if self._count == self.capacity:
+            self._evict_oldest()
+        j = self._index(self._count)
+        self._time_stamps[j] = time_stamp
+        self._event_texts[j] = event
+        self._count += 1
+        if self.event_log is not None:
+            try:
+                self.event_log.append(event, time_stamp)
+            except Exception as e:
+                print(f"Exception logging sensory stream event, logging stopped: {e}")
+                self.event_log_error = e
+                self.event_log = None
+
+    async def compact_async(self, summarize_fn):
+        """Folds the evicted events into the summary with `await summarize_fn(summary, lines)`,
+        which returns the new summary. Safe to run alongside appends. The events stay in
+        `evicted` (and in pritty_print_stable) until the new summary replaces them."""
+        if len(self.evicted) == 0:
+            return
+        events = self.evicted[:]
+        dropped_before = self.dropped_events
+        now = time.time()
+        lines = [f"{event.event} - {pretty_print_time_since(event.time_stamp, now)}" for event in events]
+        summary = await summarize_fn(self.summary, lines)
+        # appends while we waited may have trimmed some of them off the front already
+        del self.evicted[:max(len(events) - (self.dropped_events - dropped_before), 0)]
+        self.summary = summary[:self.summary_max_chars]
+        self.summary_until = events[-1].time_stamp
+        self.summarized_events += len(events)
+
+    def _format_time(self, time_stamp:float, now:float, absolute_times:bool):
+        if absolute_times:
+            # to the second, the same text every time the event is rendered
+            return f"at {iso_time_stamp(time_stamp)[:19]}"
+        return pretty_print_time_since(time_stamp, now)
+
+    def _summary_lines(self, now:float, absolute_times=False, evicted_shown=False):
+        lines = []
+        if len(self.summary):
+            lines.append(f"Summary of earlier events: {self.summary} - until {self._format_time(self.summary_until, now, absolute_times)}")
+        not_shown = self.dropped_events if evicted_shown else len(self.evicted) + self.dropped_events
+        if not_shown:
+            lines.append(f"({not_shown} earlier events not shown)")
+        return lines
 
     def append_assistant_message(self, message):
         self.append_event(f"Assistant: {message}")
@@ -35,42 +171,62 @@ class SensoryStream:
     def append_user_message(self, message):
         self.append_event(f"User: {message}")
 
-    def _pretty_print_time_since(self, time_stamp):
-        time_since = self._time_since(time_stamp)
-        if time_since < 1:
-            return "just now"
-        if time_since < 60:
-            return f"{int(time_since)} seconds ago"
-        elif time_since < 3600:
-            return f"{int(time_since / 60)} minutes ago"
-        elif time_since < 86400:
-            return f"{int(time_since / 3600)} hours ago"
-        else:
-            return f"{int(time_since / 86400)} days ago"
-
-    def pritty_print(self):
-        lines:str = []
-        for event in self.events:
-            time_since = self._pretty_print_time_since(event.time_stamp)
-            lines.append(f"{event.event} - {time_since}")
+    def _pretty_print_time_since(self, time_stamp:float, now:float=None):
+        return pretty_print_time_since(time_stamp, now)
+
+    def index_at(self, time_stamp:float) -> int:
+        """Position of the first event at or after time_stamp (len(self) if there is none), by binary search."""
+        if self._count == 0:
+            return 0
+        # the ring is at most two sorted runs of the array, bisect the one that holds time_stamp
+        first_end = min(self._start + self._count, self.capacity)
+        if first_end - self._start == self._count or time_stamp <= self._time_stamps[first_end - 1]:
+            return bisect.bisect_left(self._time_stamps, time_stamp, self._start, first_end) - self._start
+        second_end = self._start + self._count - self.capacity
+        return first_end - self._start + bisect.bisect_left(self._time_stamps, time_stamp, 0, second_end)
+
+    def events_between(self, since:float=None, until:float=None):
+        """(event, time_stamp) pairs with since <= time_stamp < until, oldest first. Either bound may be None."""
+        lo = 0 if since is None else self.index_at(since)
+        hi = self._count if until is None else self.index_at(until)
+        return self._iter_range(lo, hi)
+
+    def pritty_print_lines(self, since:float=None, until:float=None, now:float=None, absolute_times=False):
+        """Lazily rendered lines for events_between(since, until). Times are relative to now ("5 seconds ago")
+        unless absolute_times, which keeps each line the same from one render to the next."""
+        now = time.time() if now is None else now
+        return (f"{event} - {self._format_time(time_stamp, now, absolute_times)}" for event, time_stamp in self.events_between(since, until))
+
+    def pritty_print(self, absolute_times=False):
+        now = time.time()
+        lines = itertools.chain(self._summary_lines(now, absolute_times), self.pritty_print_lines(now=now, absolute_times=absolute_times))
         _str = "\n".join(lines)
         return _str
     
-    def pritty_print_split(self, time_stamp_to_split:str):
-        before_lines:str = []
-        after_lines:str = []
-        for event in self.events:
-            time_since = self._pretty_print_time_since(event.time_stamp)
-            if event.time_stamp < time_stamp_to_split:
-                before_lines.append(f"{event.event} - {time_since}")
-            else:
-                after_lines.append(f"{event.event} - {time_since}")
-        _before_lines = "\n".join(before_lines)
-        _after_lines = "\n".join(after_lines)
-        return _before_lines, _after_lines
+    def pritty_print_split(self, time_stamp_to_split:float, absolute_times=False):
+        """Lines before and from time_stamp_to_split, as iterators rendered on demand."""
+        now = time.time()
+        summary_lines = self._summary_lines(now, absolute_times)
+        before_lines = self.pritty_print_lines(until=time_stamp_to_split, now=now, absolute_times=absolute_times)
+        after_lines = self.pritty_print_lines(since=time_stamp_to_split, now=now, absolute_times=absolute_times)
+        if self.summary_until is None or self.summary_until < time_stamp_to_split:
+            return itertools.chain(summary_lines, before_lines), after_lines
+        return before_lines, itertools.chain(summary_lines, after_lines)
+
+    def pritty_print_stable(self, since:float=None):
+        """(summary lines, event lines) with absolute times, for prompts a provider can prefix cache.
+
+        The event lines are every event the summary does not cover yet, from since on: the
+        evicted ones waiting for compact_async, then the ring. Evicting an event moves it
+        from one to the other without changing the lines, so between compactions they only
+        grow at the end; the summary lines only change when compact_async runs."""
+        summary_lines = self._summary_lines(None, absolute_times=True, evicted_shown=True)
+        evicted_lines = (f"{event.event} - {self._format_time(event.time_stamp, None, True)}"
+                         for event in self.evicted if since is None or event.time_stamp >= since)
+        return summary_lines, itertools.chain(evicted_lines, self.pritty_print_lines(since=since, absolute_times=True))
 
 if __name__ == "__main__":
-    stream = SesoryStream()
+    stream = SensoryStream()
     stream.append_event("new user enters the chat")
     print("-----")
     print(stream.pritty_print())
@@ -0,0 +1,120 @@
+import re
+
+
+class SentenceSegmenter:
+    """Splits streamed LLM text into sentences as it arrives.
+
+    A sentence ends at . ? or ! (runs like "..." or "?!" included), followed by any closing
+    quotes or brackets, followed by whitespace. Terminators inside ( ), [ ] or " " do not
+    end a sentence until the bracket or quote is closed; a newline resets the nesting so an
+    unbalanced quote can't hold everything back. Whitespace after a sentence stays at the
+    start of the next one.
+
+    Brackets right after ":" or ";" are emoticons like ":(" and are plain text. Nesting
+    holds a sentence back for at most max_nested_chars characters after the outermost
+    bracket or quote opened; a terminator after that ends the sentence anyway, so one
+    unbalanced "(" can't hold back everything up to the next newline.
+
+    Only the new text is scanned on each feed, and only the characters that can change the
+    state are visited, so work is amortized O(1) per character however long the text goes
+    without a sentence ending.
+    """
+    _significant = re.compile(r'[.?!()\[\]"\s]')
+
+    def __init__(self, max_nested_chars=200):
+        self.max_nested_chars = max_nested_chars
+        self._parts = []
+        self._pending_length = 0
+        # offset into pending where the current candidate sentence would end
+        self._boundary = None
+        self._after_terminator = False
+        self._depth = 0
+        self._in_quote = False
+        # offset into pending where the outermost bracket or quote opened
+        self._nest_start = None
+        self._previous_char = ""
+
+    @property
+    def pending(self) -> str:
+        """Text fed but not yet returned as a sentence. Joined on demand, reading it after every chunk costs O(len(pending))."""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def _take(self, end):
+        pending = self.pending
+        self._parts = [pending[end:]] if end < len(pending) else []
+        self._pending_length -= end
+        if self._nest_start is not None:
+            self._nest_start -= end
+        return pending[:end]
+
+    def _reset_nesting(self):
+        self._depth = 0
+        self._in_quote = False
+        self._nest_start = None
+
+    def feed(self, text:str) -> [str]:
+        """Adds a chunk of streamed text, returns the sentences it completed."""
+        sentences = []
+        offset = self._pending_length
+        self._parts.append(text)
+        self._pending_length += len(text)
+        previous_end = 0
+        for match in self._significant.finditer(text):
+            i = match.start()
+            if i > previous_end:
+                # ordinary characters, anything before them is mid sentence
+                self._after_terminator = False
+                self._boundary = None
+            previous_end = i + 1
+            c = text[i]
+            if c in "()[]" and (text[i - 1] if i > 0 else self._previous_char) in ":;":
+                # an emoticon, plain text
+                self._after_terminator = False
+                self._boundary = None
+            elif c.isspace():
+                if self._boundary is not None:
+                    end = self._boundary
+                    self._boundary = None
+                    sentences.append(self._take(end))
+                    offset -= end
+                self._after_terminator = False
+                if c == "\n":
+                    self._reset_nesting()
+            elif c in ".?!":
+                self._after_terminator = True
+                if self._nest_start is not None and offset + i - self._nest_start > self.max_nested_chars:
+                    self._reset_nesting()
+                if self._depth == 0 and not self._in_quote:
+                    self._boundary = offset + i + 1
+            elif c in ")]" or (c == '"' and self._in_quote):
+                if c == '"':
+                    self._in_quote = False
+                elif self._depth > 0:
+                    self._depth -= 1
+                if self._depth == 0 and not self._in_quote:
+                    self._nest_start = None
+                if self._after_terminator and self._depth == 0 and not self._in_quote:
+                    self._boundary = offset + i + 1
+            else:
+                if self._depth == 0 and not self._in_quote:
+                    self._nest_start = offset + i
+                if c == '"':
+                    self._in_quote = True
+                else:
+                    self._depth += 1
+                self._after_terminator = False
+                self._boundary = None
+        if len(text) > previous_end:
+            self._after_terminator = False
+            self._boundary = None
+        if len(text):
+            self._previous_char = text[-1]
+        return sentences
+
+    def flush(self) -> str:
+        """Ends the stream, returns whatever text is left over."""
+        remainder = self.pending
+        self.__init__(self.max_nested_chars)
+        return remainder
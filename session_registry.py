@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+import traceback
+from collections import OrderedDict
+
+
+class SessionRegistry:
+    """Maps a socket.io sid to its own pipeline (a Main instance) and evicts idle sessions.
+
+    Sessions are kept in least-recently-used order. A session is evicted when it has been
+    idle for longer than idle_ttl seconds, or when creating a new session would exceed
+    max_sessions (the least recently used session goes first).
+
+    Concurrent get_or_create calls for the same sid share one creation, so the factory
+    runs exactly once per sid; sessions still being created count towards max_sessions.
+    """
+    def __init__(self, session_factory, max_sessions=None, idle_ttl=None, reap_interval=30):
+        self._session_factory = session_factory
+        self.max_sessions = max_sessions if max_sessions is not None else int(os.getenv("AGENT_LAB_MAX_SESSIONS", "32"))
+        self.idle_ttl = idle_ttl if idle_ttl is not None else float(os.getenv("AGENT_LAB_SESSION_TTL", "900"))
+        self.reap_interval = reap_interval
+        self._sessions = OrderedDict()
+        self._last_seen = {}
+        # sid -> future for a session being created
+        self._creating = {}
+        # sids evicted while their session was being created
+        self._evicted_while_creating = set()
+        self._reaper_task = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, sid):
+        return sid in self._sessions
+
+    def get(self, sid):
+        session = self._sessions.get(sid)
+        if session is not None:
+            self.touch(sid)
+        return session
+
+    def touch(self, sid):
+        if sid in self._sessions:
+            self._sessions.move_to_end(sid)
+            self._last_seen[sid] = time.monotonic()
+
+    async def get_or_create(self, sid):
+        session = self.get(sid)
+        if session is not None:
+            return session
+        creating = self._creating.get(sid)
+        if creating is not None:
+            return await asyncio.shield(creating)
+        creating = asyncio.get_running_loop().create_future()
+        self._creating[sid] = creating
+        try:
+            session = await self._create(sid)
+        except asyncio.CancelledError:
+            creating.cancel()
+            raise
+        except BaseException as e:
+            creating.set_exception(e)
+            # mark it retrieved, the other callers (if any) get it raised too
+            creating.exception()
+            raise
+        else:
+            creating.set_result(session)
+        finally:
+            del self._creating[sid]
+        if sid in self._evicted_while_creating:
+            self._evicted_while_creating.discard(sid)
+            await self.evict(sid)
+        return session
+
+    async def _create(self, sid):
+        while len(self._sessions) and len(self._sessions) + len(self._creating) > self.max_sessions:
+            oldest_sid = next(iter(self._sessions))
+            print(f"Session cap ({self.max_sessions}) reached, evicting least recently used session: {oldest_sid}")
+            await self.evict(oldest_sid)
+        session = self._session_factory(sid)
+        await session.start()
+        self._sessions[sid] = session
+        self._last_seen[sid] = time.monotonic()
+        return session
+
+    async def evict(self, sid):
+        if sid in self._creating:
+            # evicted as soon as get_or_create has it
+            self._evicted_while_creating.add(sid)
+        session = self._sessions.pop(sid, None)
+        self._last_seen.pop(sid, None)
+        if session is not None:
+            await session.stop()
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        expired = [sid for sid, last_seen in self._last_seen.items() if now - last_seen > self.idle_ttl]
+        for sid in expired:
+            print(f"Evicting idle session: {sid}")
+            await self.evict(sid)
+        return expired
+
+    async def _reap_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.reap_interval)
+                await self.evict_idle()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Exception in session reaper: {e}")
+                trace = traceback.format_exc()
+                print(f"trace: {trace}")
+
+    def start(self):
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            await asyncio.gather(self._reaper_task, return_exceptions=True)
+            self._reaper_task = None
+        for sid in list(self._sessions.keys()):
+            await self.evict(sid)
@@ -0,0 +1,33 @@
+import asyncio
+import os
+
+os.environ.setdefault("AGENT_LAB_LLM_BACKEND", "fake")
+
+from app import Main
+
+
+def test_resync_resends_full_chat():
+    async def run():
+        main = Main("resync-test")
+        emitted = []
+
+        async def emit(event, data):
+            emitted.append((event, data))
+        main.emit = emit
+
+        await main.emit_chat_history("")
+        # nothing changed, nothing to send
+        await main.emit_chat_history("")
+        assert [event for event, _ in emitted] == ["update_chat"]
+
+        emitted.clear()
+        main.request_resync("chat")
+        await main.emit_chat_history("")
+        assert len(emitted) == 1
+        event, update = emitted[0]
+        assert event == "update_chat"
+        assert update["full"]
+        assert update["lines"] == main.chat_history
+        await main.stop()
+
+    asyncio.run(run())
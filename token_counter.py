@@ -0,0 +1,38 @@
+import functools
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# chat messages cost a few tokens on top of their content (role, separators)
+tokens_per_message = 4
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model_id):
+    """The model's tiktoken encoding, None when tiktoken is missing or can't load it."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_id)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # the BPE file is downloaded on first use, which fails offline
+        print(f"tiktoken could not load an encoding for {model_id}, estimating tokens as len / 4: {e}")
+        return None
+
+
+def count_tokens(text:str, model_id="gpt-3.5-turbo") -> int:
+    """Tokens in text, with tiktoken when it is installed and can load the encoding, otherwise estimated as len(text) / 4."""
+    encoding = _encoding(model_id)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(message:dict, model_id="gpt-3.5-turbo") -> int:
+    return tokens_per_message + count_tokens(message["content"] or "", model_id)
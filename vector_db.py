@@ -2,30 +2,51 @@ import asyncio
 import json
 import os
 import sys
+import time
 import traceback
-import chromadb
-from chromadb.utils import embedding_functions
+from typing import TYPE_CHECKING
 import uuid
 import numpy as np
 
+if TYPE_CHECKING:
+    import chromadb
+
+from embedding_cache import EmbeddingCache
+from vector_index import ChromaIndex, NumpyIndex
+
 class VectorDB:
-    def __init__(self):
+    def __init__(self, backend=None, embed_batch_size=64, insert_batch_size=None):
         self._initialized = False
-        self.client = chromadb.PersistentClient(path=os.path.join(".", "vector_db"))
-        self.beliefs_and_desires_collection = self.client.get_or_create_collection(
-            name="beliefs_and_desires",
-            metadata={"hnsw:space": "l2"}
-            # metadata={"hnsw:space": "cosine"} # l2 is the default
-            )
+        self.embed_batch_size = embed_batch_size
+        self.insert_batch_size = insert_batch_size
+        backend = backend or os.getenv("AGENT_LAB_VECTOR_BACKEND", "chroma")
+        if backend == "chroma":
+            self.beliefs_and_desires_collection = ChromaIndex(os.path.join(".", "vector_db"), space="l2")
+        elif backend == "numpy":
+            self.beliefs_and_desires_collection = NumpyIndex(os.path.join(".", "vector_db_numpy"), space="l2")
+        elif isinstance(backend, str):
+            raise ValueError(f"Unknown vector backend: {backend}, expected 'chroma' or 'numpy'")
+        else:
+            # any object with the ChromaIndex / NumpyIndex interface
+            self.beliefs_and_desires_collection = backend
+        # imported here so only the embedding model, not the vector store, needs chroma
+        from chromadb.utils import embedding_functions
         self.embed = embedding_functions.DefaultEmbeddingFunction()
+        # DefaultEmbeddingFunction is chroma's ONNX build of all-MiniLM-L6-v2
+        self.embedding_cache = EmbeddingCache(os.path.join(".", "embedding_cache"), model_name="all-MiniLM-L6-v2")
+
+    def _embed(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        return self.embedding_cache.get_many(texts, self.embed)
 
     def initialize(self):
         if self.beliefs_and_desires_collection.count() == 0:
             self.init_beilefs_and_desires()
-        self._embedding_size = len(self.embed(["test"])[0])
+        self._embedding_size = len(self._embed(["test"])[0])
         self._initialized = True
    
-    def init_beilefs_and_desires(self):
+    def _load_priors(self):
         # load beliefts from priors/beliefs.json
         beliefs_file_path = os.path.join('priors', 'beliefs.json')
         with open(beliefs_file_path) as json_file:
@@ -34,56 +55,124 @@ class VectorDB:
         with open(desires_file_path) as json_file:
             desires = json.load(json_file)
         b_and_d = beliefs | desires
-        total = sum(len(b_and_d[key]) for key in b_and_d)
-        print(f"Adding {total} beliefs and desires to beliefs_and_desires_collection...")
-        i = 0
+        documents = []
+        metadatas = []
         for category in b_and_d.keys():
-            documents = []
-            metadatas = []
-            ids = []
-            embeddings = []
             category_lower = category.lower()
             prior_type = "belief" if "belief" in category_lower else "desire" if "desire" in category_lower else None
             metadata = {"prior_category": category, "prior_type": prior_type} if prior_type else {"prior_category": category}
             for value in b_and_d[category]:
-                percentage = (i + 1) / total * 100
-                progress = int(percentage // (100/60))
-                bar = f"[{'#' * progress}{'.' * (60 - progress)}] {percentage:.2f}%"
-                print(f"\r{bar}", end="")
                 documents.append(value)
                 metadatas.append(metadata)
-                e = self.embed([value])[0]
-                embeddings.append(e)
-                ids.append(str(uuid.uuid4()))
-                i += 1
+        return documents, metadatas
+
+    def _print_progress(self, done, total, start_time):
+        percentage = done / total * 100
+        progress = int(percentage // (100/60))
+        bar = f"[{'#' * progress}{'.' * (60 - progress)}] {percentage:.2f}%"
+        docs_per_second = done / max(time.perf_counter() - start_time, 1e-9)
+        print(f"\r{bar} {docs_per_second:.1f} docs/s", end="")
+
+    def _get_insert_batch_size(self):
+        if self.insert_batch_size is not None:
+            return self.insert_batch_size
+        return self.beliefs_and_desires_collection.max_batch_size
+
+    def init_beilefs_and_desires(self):
+        documents, metadatas = self._load_priors()
+        total = len(documents)
+        print(f"Adding {total} beliefs and desires to beliefs_and_desires_collection...")
+        start_time = time.perf_counter()
+        insert_batch_size = self._get_insert_batch_size()
+        pending = {"documents": [], "metadatas": [], "ids": [], "embeddings": []}
+
+        def flush():
+            if len(pending["ids"]) == 0:
+                return
             try:
-                self.beliefs_and_desires_collection.add(
-                    documents=documents,
-                    metadatas=metadatas,
-                    ids=ids,
-                    embeddings=embeddings
-                )
+                self.beliefs_and_desires_collection.add(**pending)
             except Exception as e:
-                print(f"Error adding {category} to beliefs_and_desires_collection: {e}")
+                print(f"Error adding {len(pending['ids'])} priors to beliefs_and_desires_collection: {e}")
                 trace = traceback.format_exc()
                 print(f"trace: {trace}")
                 raise e
+            for values in pending.values():
+                values.clear()
+
+        for i in range(0, total, self.embed_batch_size):
+            batch_documents = documents[i:i + self.embed_batch_size]
+            embeddings = self._embed(batch_documents)
+            pending["documents"].extend(batch_documents)
+            pending["metadatas"].extend(metadatas[i:i + self.embed_batch_size])
+            pending["ids"].extend(str(uuid.uuid4()) for _ in batch_documents)
+            pending["embeddings"].extend(embeddings)
+            if len(pending["ids"]) >= insert_batch_size:
+                flush()
+            self._print_progress(i + len(batch_documents), total, start_time)
+        flush()
+        self.beliefs_and_desires_collection.persist()
+        elapsed = time.perf_counter() - start_time
         print()
+        print(f"Added {total} priors in {elapsed:.2f}s ({total / max(elapsed, 1e-9):.1f} docs/s)")
 
     def get_embedding_size(self):
         assert self._initialized, "VectorDB not initialized. Call initialize() first."
         return self._embedding_size
 
+    def _prior_filter(self, prior_category=None, prior_type=None):
+        clauses = []
+        if prior_category is not None:
+            clauses.append({"prior_category": prior_category})
+        if prior_type is not None:
+            clauses.append({"prior_type": prior_type})
+        if len(clauses) == 0:
+            return None
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$and": clauses}
+
     def search(self, query_text, n_results=5, prior_category=None, prior_type=None):
         assert self._initialized, "VectorDB not initialized. Call initialize() first."
-        assert prior_category is None and prior_type is None, "Not implemented yet."
         sorted_results = self.beliefs_and_desires_collection.query(
-            query_texts=query_text,
+            query_embeddings=self._embed(query_text),
             n_results=n_results,
+            where=self._prior_filter(prior_category, prior_type)
         )
         return sorted_results
     
-    def embeddings_search(self, embeddings, n_results=5, where:chromadb.Where = None):
+    def search_many(self, query_texts, n_results=5, prior_category=None, prior_type=None, dedupe=False):
+        """Search for several texts with one embedding batch and one index query.
+
+        Returns one result per query, each {"ids", "distances", "documents", "metadatas"}
+        for that query alone. With dedupe=True a document is only returned for the first
+        query that finds it, and later queries are topped up from further down their list.
+        """
+        assert self._initialized, "VectorDB not initialized. Call initialize() first."
+        query_texts = list(query_texts)
+        if len(query_texts) == 0:
+            return []
+        n_fetch = n_results * len(query_texts) if dedupe else n_results
+        sorted_results = self.beliefs_and_desires_collection.query(
+            query_embeddings=self._embed(query_texts),
+            n_results=n_fetch,
+            where=self._prior_filter(prior_category, prior_type)
+        )
+        results = []
+        seen_ids = set()
+        for i in range(len(query_texts)):
+            result = {"ids": [], "distances": [], "documents": [], "metadatas": []}
+            for j, id in enumerate(sorted_results["ids"][i]):
+                if len(result["ids"]) == n_results:
+                    break
+                if dedupe and id in seen_ids:
+                    continue
+                seen_ids.add(id)
+                for key in result:
+                    result[key].append(sorted_results[key][i][j])
+            results.append(result)
+        return results
+
+    def embeddings_search(self, embeddings, n_results=5, where:"chromadb.Where" = None):
         assert self._initialized, "VectorDB not initialized. Call initialize() first."
         sorted_results = self.beliefs_and_desires_collection.query(
             query_embeddings=embeddings,
@@ -94,7 +183,7 @@ class VectorDB:
     
     def get_embeddings(self, document:str):
         assert self._initialized, "VectorDB not initialized. Call initialize() first."
-        embeddings = self.embed(document)
+        embeddings = self._embed(document).tolist()
         return embeddings
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+import json
+import os
+import numpy as np
+
+
+class ChromaIndex:
+    """VectorDB backend on a chromadb PersistentClient collection (sqlite + HNSW)."""
+    def __init__(self, path, name="beliefs_and_desires", space="l2"):
+        import chromadb
+        self.client = chromadb.PersistentClient(path=path)
+        self.collection = self.client.get_or_create_collection(
+            name=name,
+            metadata={"hnsw:space": space}
+            )
+
+    @property
+    def max_batch_size(self):
+        # chroma rejects adds larger than what its sqlite backend can bind in one statement
+        return getattr(self.client, "max_batch_size", 1024)
+
+    def count(self):
+        return self.collection.count()
+
+    def add(self, ids, documents, metadatas, embeddings):
+        self.collection.add(
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=[list(map(float, e)) for e in embeddings]
+        )
+
+    def persist(self):
+        # PersistentClient writes through on every add
+        pass
+
+    def query(self, query_embeddings, n_results=5, where=None):
+        return self.collection.query(
+            query_embeddings=[list(map(float, e)) for e in query_embeddings],
+            n_results=n_results,
+            where=where
+        )
+
+
+class NumpyIndex:
+    """VectorDB backend holding every embedding in one contiguous float32 matrix.
+
+    Queries are a vectorized brute-force scan, which for a few thousand priors is faster
+    than HNSW and starts instantly. Persisted as {path}/embeddings.npy plus
+    {path}/records.json for ids, documents and metadatas.
+
+    Distances follow chroma: squared L2 for "l2", 1 - cosine similarity for "cosine".
+
+    Every scalar metadata value gets a partition (the rows holding it), so a `where`
+    filter such as {"prior_type": "desire"} only scans that partition's rows. Supported
+    filters are equality ({"key": value} or {"key": {"$eq": value}}) and "$and" of those.
+    """
+    def __init__(self, path, space="l2"):
+        assert space in ("l2", "cosine"), f"Unsupported space: {space}"
+        self.path = path
+        self.space = space
+        self.max_batch_size = 1 << 20
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        # squared norm of each row, grown alongside _matrix
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._count = 0
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._partitions = {}
+        self._partition_cache = {}
+        self._load()
+
+    @property
+    def _embeddings_path(self):
+        return os.path.join(self.path, "embeddings.npy")
+
+    @property
+    def _records_path(self):
+        return os.path.join(self.path, "records.json")
+
+    def _load(self):
+        if not os.path.exists(self._embeddings_path) or not os.path.exists(self._records_path):
+            return
+        with open(self._records_path) as json_file:
+            records = json.load(json_file)
+        self._ids = records["ids"]
+        self._documents = records["documents"]
+        self._metadatas = records["metadatas"]
+        self._matrix = np.load(self._embeddings_path)
+        self._count = self._matrix.shape[0]
+        assert self._count == len(self._ids), f"{self._embeddings_path} and {self._records_path} are out of sync."
+        if self.space == "cosine":
+            self._matrix = self._normalize(self._matrix)
+        self._norms = self._row_norms(self._matrix)
+        self._index_partitions(0, self._metadatas)
+
+    def _normalize(self, vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _row_norms(self, embeddings):
+        return np.einsum("ij,ij->i", embeddings, embeddings)
+
+    @property
+    def _squared_norms(self):
+        return self._norms[:self._count]
+
+    def _index_partitions(self, first_row, metadatas):
+        for row, metadata in enumerate(metadatas, start=first_row):
+            for key, value in (metadata or {}).items():
+                if isinstance(value, (str, int, float, bool)):
+                    self._partitions.setdefault((key, value), []).append(row)
+        self._partition_cache = {}
+
+    def _partition(self, key, value):
+        """Rows, embeddings and squared norms for one metadata value, cached until the next add."""
+        if (key, value) not in self._partition_cache:
+            rows = np.array(self._partitions.get((key, value), []), dtype=np.int64)
+            self._partition_cache[(key, value)] = (rows, self._matrix[rows], self._squared_norms[rows])
+        return self._partition_cache[(key, value)]
+
+    def _where_terms(self, where):
+        terms = []
+        for key, value in where.items():
+            if key == "$and":
+                for clause in value:
+                    terms.extend(self._where_terms(clause))
+            elif isinstance(value, dict):
+                if list(value.keys()) != ["$eq"]:
+                    raise ValueError(f"Unsupported where operator for NumpyIndex: {value}")
+                terms.append((key, value["$eq"]))
+            else:
+                terms.append((key, value))
+        return terms
+
+    def _filter(self, where):
+        terms = self._where_terms(where)
+        if len(terms) == 0:
+            return None
+        # scan the smallest partition, narrowed by the others
+        partitions = sorted((self._partition(key, value) for key, value in terms), key=lambda p: len(p[0]))
+        rows, embeddings, squared_norms = partitions[0]
+        if len(partitions) == 1:
+            return partitions[0]
+        for other_rows, _, _ in partitions[1:]:
+            rows = np.intersect1d(rows, other_rows, assume_unique=True)
+        return rows, self._matrix[rows], self._squared_norms[rows]
+
+    def count(self):
+        return self._count
+
+    def add(self, ids, documents, metadatas, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        assert len(ids) == len(documents) == len(metadatas) == embeddings.shape[0], "ids, documents, metadatas and embeddings must be the same length."
+        if self.space == "cosine":
+            embeddings = self._normalize(embeddings)
+        needed = self._count + embeddings.shape[0]
+        if self._matrix.shape[1] != embeddings.shape[1]:
+            assert self._count == 0, f"Embedding size {embeddings.shape[1]} does not match index size {self._matrix.shape[1]}."
+            self._matrix = np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+        if needed > self._matrix.shape[0]:
+            # grow geometrically so a stream of small adds stays amortized O(1) per row
+            capacity = max(needed, 2 * self._matrix.shape[0], 64)
+            matrix = np.zeros((capacity, embeddings.shape[1]), dtype=np.float32)
+            matrix[:self._count] = self._matrix[:self._count]
+            self._matrix = matrix
+            norms = np.zeros(capacity, dtype=np.float32)
+            norms[:self._count] = self._norms[:self._count]
+            self._norms = norms
+        self._matrix[self._count:needed] = embeddings
+        self._norms[self._count:needed] = self._row_norms(embeddings)
+        self._count = needed
+        self._ids.extend(ids)
+        self._documents.extend(documents)
+        self._metadatas.extend(metadatas)
+        self._index_partitions(needed - len(metadatas), metadatas)
+
+    def persist(self):
+        os.makedirs(self.path, exist_ok=True)
+        np.save(self._embeddings_path, self._matrix[:self._count])
+        with open(self._records_path, "w") as json_file:
+            json.dump({"ids": self._ids, "documents": self._documents, "metadatas": self._metadatas}, json_file)
+
+    def _distances(self, queries, embeddings, squared_norms):
+        if self.space == "cosine":
+            return 1. - self._normalize(queries) @ embeddings.T
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+        distances = query_norms[:, None] + squared_norms[None, :] - 2. * (queries @ embeddings.T)
+        return np.maximum(distances, 0.)
+
+    def _top_k(self, distances, n_results):
+        if n_results < distances.shape[1]:
+            top = np.argpartition(distances, n_results - 1, axis=1)[:, :n_results]
+        else:
+            top = np.broadcast_to(np.arange(distances.shape[1]), (distances.shape[0], distances.shape[1]))
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+
+    def query(self, query_embeddings, n_results=5, where=None):
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        partition = self._filter(where) if where else None
+        if partition is None:
+            rows = None
+            embeddings = self._matrix[:self._count]
+            squared_norms = self._squared_norms
+        else:
+            rows, embeddings, squared_norms = partition
+        results = {"ids": [], "distances": [], "documents": [], "metadatas": [], "embeddings": None}
+        if embeddings.shape[0] == 0:
+            for key in ("ids", "distances", "documents", "metadatas"):
+                results[key] = [[] for _ in range(queries.shape[0])]
+            return results
+        top, top_distances = self._top_k(self._distances(queries, embeddings, squared_norms), min(n_results, embeddings.shape[0]))
+        if rows is not None:
+            top = rows[top]
+        for query_rows, query_distances in zip(top, top_distances):
+            results["ids"].append([self._ids[row] for row in query_rows])
+            results["distances"].append(query_distances.tolist())
+            results["documents"].append([self._documents[row] for row in query_rows])
+            results["metadatas"].append([self._metadatas[row] for row in query_rows])
+        return results